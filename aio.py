@@ -0,0 +1,129 @@
+"""
+Async read path for pages that need several independent queries.
+
+Each query runs on its own pooled connection and they all run at the same
+time, so a page waits for its slowest query instead of the sum of them all.
+The views stay synchronous: every worker process runs one asyncio event loop
+in a background thread with an async SQLAlchemy engine (psycopg 3), and a
+view hands it a coroutine with run() and blocks until it is done.
+
+    async def load_page(adb, hid):
+        return await asyncio.gather(adb.fetch(queries.HOUSEHOLD_PLANS, {'hid': hid}),
+                                    adb.fetch(queries.HOUSEHOLD_PLAN_RECIPES, {'hid': hid}))
+
+    adb = aio.get_db()
+    plans, recipes = adb.run(load_page(adb, hid))
+
+The async pool is sized from the same DATABASE_POOL_* settings as the sync
+one (see db.py). Statement timings still count towards the request in
+metrics.py. With read replicas (see db.py) a read request gets the async pool
+of the same replica its g.conn uses. Connections prepare the statements they run repeatedly on the
+server (DATABASE_PREPARE_THRESHOLD, see queries.py).
+"""
+import asyncio
+import contextvars
+import os
+import threading
+
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import db
+import metrics
+
+_databases = []
+
+# The event loop thread this process runs every database's queries on
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+# metrics.request_context() of the request a coroutine on the loop thread works for
+_request = contextvars.ContextVar('request', default=None)
+
+
+def _event_loop():
+    """This process's event loop, started on first use (a forked worker starts its own)."""
+    global _loop, _loop_pid
+    if _loop_pid != os.getpid():
+        with _loop_lock:
+            if _loop_pid != os.getpid():
+                _loop = asyncio.new_event_loop()
+                threading.Thread(target=_loop.run_forever, name="db-async-loop", daemon=True).start()
+                _loop_pid = os.getpid()
+    return _loop
+
+
+class AsyncDatabase:
+
+    def __init__(self, uri, primary=None):
+        # The psycopg 3 driver, which SQLAlchemy runs in async mode with create_async_engine
+        self.uri = db.psycopg_uri(uri)
+        # The primary's AsyncDatabase, for loads cached across requests (see db.primary).
+        # All databases share the process's event loop, so a replica's coroutine can await it.
+        self.primary = primary or self
+        self.engine = None
+        self._pid = None
+        self._lock = threading.Lock()
+        _databases.append(self)
+
+    def _ensure_started(self):
+        # The pool is per process: a forked worker creates its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            engine = create_async_engine(self.uri, connect_args={'prepare_threshold': db.prepare_threshold_from_env()},
+                                         **db.pool_options_from_env())
+            metrics.instrument(engine.sync_engine)
+            self.engine = engine
+            self._pid = os.getpid()
+
+    def run(self, awaitable):
+        """Runs awaitable on the loop thread and returns its result (or raises its exception)."""
+        context = metrics.request_context()
+
+        async def bound():
+            _request.set(context)
+            return await awaitable
+
+        return asyncio.run_coroutine_threadsafe(bound(), _event_loop()).result()
+
+    async def fetch(self, statement, params=None):
+        """All rows of one query (a queries.py statement or an SQL string), on a connection of its own."""
+        if isinstance(statement, str):
+            statement = text(statement)
+        self._ensure_started()
+        async with self.engine.connect() as conn:
+            # Statements run in a greenlet that does not see this task's context
+            metrics.bind_connection(conn.sync_connection, _request.get())
+            try:
+                result = await conn.execute(statement, params or {})
+                return result.fetchall()
+            finally:
+                metrics.bind_connection(conn.sync_connection, None)
+
+    def dispose(self):
+        if self._pid == os.getpid():
+            asyncio.run_coroutine_threadsafe(self.engine.dispose(), _loop).result(timeout=10)
+
+
+def init_app(app, uri, replica_uris=()):
+    primary = app.extensions['db_async'] = AsyncDatabase(uri)
+    app.extensions['db_async_replicas'] = [AsyncDatabase(replica, primary) for replica in replica_uris]
+
+
+def get_db():
+    """The async database this request reads from: the same replica as g.conn, or the primary."""
+    replica = db.read_replica()
+    if replica is None:
+        return current_app.extensions['db_async']
+    return current_app.extensions['db_async_replicas'][replica]
+
+
+def dispose_all():
+    """Closes every async pool in this process; called when a worker shuts down."""
+    for database in _databases:
+        database.dispose()
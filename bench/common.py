@@ -0,0 +1,18 @@
+"""Shared helpers for the benchmark scripts."""
+import os
+import sys
+
+from sqlalchemy.engine import make_url
+
+
+def database_url(url=None):
+    """
+    The benchmark database: --url or BENCH_DATABASE_URL. Deliberately not the
+    DATABASE_* settings from .env, so a benchmark can never reset the course
+    database by accident.
+    """
+    url = url or os.getenv("BENCH_DATABASE_URL")
+    if not url:
+        sys.exit("set BENCH_DATABASE_URL or pass --url, e.g. postgresql://localhost/recipes_bench")
+    # The psycopg 3 driver, like the app (see db.psycopg_uri)
+    return make_url(url).set(drivername='postgresql+psycopg')
@@ -0,0 +1,142 @@
+"""
+Creates the app's schema in a local Postgres database and fills it with a
+synthetic, reproducible recipe dataset.
+
+    python bench/generate.py --url postgresql://localhost/recipes_bench --reset --recipes 20000
+
+The database comes from --url or BENCH_DATABASE_URL (never from .env).
+--reset drops the app's tables first and is needed to regenerate into the
+same database. migrations/ are applied on top of bench/schema.sql.
+
+Data is generated server-side with generate_series and a fixed setseed(), so
+the same options always produce the same dataset. Ingredient choice is
+skewed towards a set of common ingredients so that /cookable has realistic
+matches.
+"""
+import argparse
+import os
+import sys
+import time
+
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import migrate  # noqa: E402
+from bench.common import database_url  # noqa: E402
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+TABLES = ['grocery_list_contains_ingredients', 'grocery_list', 'meal_plan_selects_recipe', 'meal_plans',
+          'household_in_inventory_ingredient', 'recipe_made_with_ingredient', 'recipe', 'ingredient',
+          'household', 'test', 'unit_conversion', 'schema_migrations']
+
+UNITS = ['g', 'kg', 'ml', 'l', 'tsp', 'tbsp', 'cup', 'each']
+
+STEPS = [
+    ("ingredients", """
+        INSERT INTO ingredient (ingredient_name, unit)
+        SELECT 'ingredient ' || lpad(n::text, 5, '0'), (:units)[1 + floor(random() * cardinality(:units))::int]
+        FROM generate_series(1, :ingredients) n
+    """),
+    ("recipes", """
+        INSERT INTO recipe (recipe_name, portion_size, source)
+        SELECT 'recipe ' || md5(n::text), 1 + floor(random() * 8)::int, 'source ' || (n % 97)
+        FROM generate_series(1, :recipes) n
+    """),
+    # power(random(), 3) skews picks towards the first (common) ingredients
+    ("recipe ingredients", """
+        INSERT INTO recipe_made_with_ingredient (recipe_id, ingredient_id, quantity, unit)
+        SELECT pick.recipe_id, i.ingredient_id, round((1 + random() * 499)::numeric, 1), i.unit
+        FROM (
+            SELECT DISTINCT r.recipe_id, a.ids[1 + floor(power(random(), 3) * cardinality(a.ids))::int] AS ingredient_id
+            FROM recipe r
+            CROSS JOIN generate_series(1, :per_recipe)
+            CROSS JOIN (SELECT array_agg(ingredient_id ORDER BY ingredient_id) AS ids FROM ingredient) a
+        ) pick
+        JOIN ingredient i ON i.ingredient_id = pick.ingredient_id
+    """),
+    ("households", """
+        INSERT INTO household (household_name)
+        SELECT 'household ' || lpad(n::text, 5, '0')
+        FROM generate_series(1, :households) n
+    """),
+    ("inventory", """
+        INSERT INTO household_in_inventory_ingredient (household_id, ingredient_id, quantity, unit)
+        SELECT pick.household_id, i.ingredient_id, round((1 + random() * 2000)::numeric, 1), i.unit
+        FROM (
+            SELECT DISTINCT h.household_id, a.ids[1 + floor(power(random(), 2) * cardinality(a.ids))::int] AS ingredient_id
+            FROM household h
+            CROSS JOIN generate_series(1, :inventory)
+            CROSS JOIN (SELECT array_agg(ingredient_id ORDER BY ingredient_id) AS ids FROM ingredient) a
+        ) pick
+        JOIN ingredient i ON i.ingredient_id = pick.ingredient_id
+    """),
+    ("meal plans", """
+        INSERT INTO meal_plans (household_id, label)
+        SELECT h.household_id, 'Week ' || n
+        FROM household h
+        CROSS JOIN generate_series(1, :plans) n
+    """),
+    ("plan recipes", """
+        INSERT INTO meal_plan_selects_recipe (plan_id, recipe_id)
+        SELECT DISTINCT mp.plan_id, a.ids[1 + floor(random() * cardinality(a.ids))::int]
+        FROM meal_plans mp
+        CROSS JOIN generate_series(1, :per_plan)
+        CROSS JOIN (SELECT array_agg(recipe_id ORDER BY recipe_id) AS ids FROM recipe) a
+    """),
+    ("grocery lists", """
+        INSERT INTO grocery_list (plan_id)
+        SELECT plan_id FROM meal_plans ORDER BY plan_id
+    """),
+    ("grocery lines", """
+        INSERT INTO grocery_list_contains_ingredients (grocery_id, ingredient_id, quantity, unit)
+        SELECT gl.grocery_id, ri.ingredient_id, SUM(ri.quantity), MIN(ri.unit)
+        FROM grocery_list gl
+        JOIN meal_plan_selects_recipe mpsr ON mpsr.plan_id = gl.plan_id
+        JOIN recipe_made_with_ingredient ri ON ri.recipe_id = mpsr.recipe_id
+        GROUP BY gl.grocery_id, ri.ingredient_id
+    """),
+    ("test rows", """
+        INSERT INTO test (name) VALUES ('grace hopper'), ('alan turing'), ('ada lovelace')
+    """),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=None, help="database URL (default: BENCH_DATABASE_URL)")
+    parser.add_argument('--reset', action='store_true', help="drop the app's tables first")
+    parser.add_argument('--seed', type=float, default=0.42, help="setseed() value, between -1 and 1")
+    parser.add_argument('--ingredients', type=int, default=500)
+    parser.add_argument('--recipes', type=int, default=5000)
+    parser.add_argument('--per-recipe', type=int, default=8, help="ingredient picks per recipe")
+    parser.add_argument('--households', type=int, default=50)
+    parser.add_argument('--inventory', type=int, default=60, help="ingredient picks per household")
+    parser.add_argument('--plans', type=int, default=10, help="meal plans per household")
+    parser.add_argument('--per-plan', type=int, default=4, help="recipe picks per meal plan")
+    args = parser.parse_args()
+
+    engine = create_engine(database_url(args.url))
+    with engine.begin() as conn:
+        if args.reset:
+            conn.exec_driver_sql(f"DROP TABLE IF EXISTS {', '.join(TABLES)} CASCADE")
+        with open(SCHEMA_FILE) as f:
+            conn.exec_driver_sql(f.read(), execution_options={'no_parameters': True})
+    migrate.apply_migrations(engine)
+
+    params = {'units': UNITS, 'ingredients': args.ingredients, 'recipes': args.recipes,
+              'per_recipe': args.per_recipe, 'households': args.households, 'inventory': args.inventory,
+              'plans': args.plans, 'per_plan': args.per_plan}
+    with engine.begin() as conn:
+        conn.execute(text("SELECT setseed(:seed)"), {'seed': args.seed})
+        for name, sql in STEPS:
+            start = time.perf_counter()
+            count = conn.execute(text(sql), params).rowcount
+            print(f"{name:20s} {count:>9} rows  {time.perf_counter() - start:6.2f}s")
+        conn.exec_driver_sql("ANALYZE")
+    print("done")
+
+
+if __name__ == '__main__':
+    main()
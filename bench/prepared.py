@@ -0,0 +1,100 @@
+"""
+Micro-benchmark for queries.py: what typed statements and server-side
+prepared statements save per request on the /cookable and /mealplans queries.
+
+    python bench/prepared.py --url postgresql://localhost/recipes_bench --iterations 500
+
+Each request's statements run on one psycopg 3 connection, with SQLAlchemy's
+compiled cache on as in the app, in four ways:
+
+    inline            a new untyped text() per run (how the views built their
+                      queries before queries.py), not prepared
+    inline prepared   the same, prepared on the server on first use (prepare_threshold=0)
+    typed             the queries.py constant, not prepared
+    typed prepared    the same, prepared on the server on first use
+
+The compiled cache already matches equal SQL strings, so inline and typed
+differ only in building the text() object and in the parameter types sent.
+Preparing skips the planning time Postgres reports for the statements
+(EXPLAIN (SUMMARY)), also shown; the typed casts (%(hid)s::INTEGER) keep one
+prepared statement per query whatever Python value is bound. The app's sync
+and async engines both prepare, from the run after DATABASE_PREPARE_THRESHOLD
+(see db.prepare_threshold_from_env).
+"""
+import argparse
+import os
+import sys
+import time
+
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import queries  # noqa: E402
+from bench.common import database_url  # noqa: E402
+
+# request -> the statements it runs, all with {'hid': household}
+REQUESTS = {
+    'cookable': [queries.HOUSEHOLD_INVENTORY],
+    'mealplans': [queries.HOUSEHOLD_PLANS, queries.HOUSEHOLD_PLAN_RECIPES, queries.HOUSEHOLD_GROCERY_LINES],
+}
+
+
+def run(engine, statements, hids, iterations, inline):
+    """Mean seconds per request over iterations, after a warmup pass."""
+    with engine.connect() as conn:
+        for warmup in (True, False):
+            start = time.perf_counter()
+            for i in range(iterations if not warmup else 10):
+                params = {'hid': hids[i % len(hids)]}
+                for statement in statements:
+                    if inline:
+                        statement = text(statement.text)
+                    conn.execute(statement, params).fetchall()
+            elapsed = time.perf_counter() - start
+        conn.rollback()
+    return elapsed / iterations
+
+
+def planning_ms(engine, statements, hid):
+    """Planning time Postgres reports for one run of each statement."""
+    total = 0.0
+    with engine.connect() as conn:
+        for statement in statements:
+            plan = conn.execute(text("EXPLAIN (SUMMARY) " + statement.text), {'hid': hid}).scalars().all()
+            total += float(next(line for line in plan if line.startswith('Planning Time')).split()[2])
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=None, help="benchmark database URL (default: BENCH_DATABASE_URL)")
+    parser.add_argument('--iterations', type=int, default=500, help="requests per measurement")
+    parser.add_argument('--households', type=int, default=20, help="households to rotate through")
+    args = parser.parse_args()
+
+    url = database_url(args.url)
+    plain = create_engine(url, connect_args={'prepare_threshold': None})
+    prepared = create_engine(url, connect_args={'prepare_threshold': 0})
+    with plain.connect() as conn:
+        hids = conn.execute(text("SELECT household_id FROM household ORDER BY household_id LIMIT :n"),
+                            {'n': args.households}).scalars().all()
+    if not hids:
+        sys.exit("the benchmark database is empty; run bench/generate.py first")
+
+    print(f"{'request':12s} {'inline us':>10s} {'inline prep us':>15s} {'typed us':>9s} "
+          f"{'typed prep us':>14s} {'saved %':>8s} {'planning us':>12s}")
+    for name, statements in REQUESTS.items():
+        inline = run(plain, statements, hids, args.iterations, inline=True)
+        inline_prep = run(prepared, statements, hids, args.iterations, inline=True)
+        typed = run(plain, statements, hids, args.iterations, inline=False)
+        typed_prep = run(prepared, statements, hids, args.iterations, inline=False)
+        planning = planning_ms(plain, statements, hids[0])
+        print(f"{name:12s} {1e6 * inline:10.1f} {1e6 * inline_prep:15.1f} {1e6 * typed:9.1f} "
+              f"{1e6 * typed_prep:14.1f} {100 * (inline - typed_prep) / inline:7.1f}% {1000 * planning:12.1f}")
+    plain.dispose()
+    prepared.dispose()
+
+
+if __name__ == '__main__':
+    main()
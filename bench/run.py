@@ -0,0 +1,352 @@
+"""
+Drives the routes in server.py under concurrency and reports throughput,
+latency percentiles and SQL statements per request.
+
+Start the server against a benchmark database (see bench/generate.py), then:
+
+    python bench/run.py --url postgresql://localhost/recipes_bench \\
+        --server http://localhost:8111 --concurrency 8 --requests 200
+
+Queries per request come from the Server-Timing header the app adds to every
+response. --save-baseline FILE writes the results as JSON; --baseline FILE
+compares against an earlier run and exits with status 1 when a scenario's p95
+latency grows by more than --tolerance or it issues more SQL statements, so
+regressions in /cookable or /mealplans show up before they ship.
+
+Scenarios that write (households, inventory, meal plans, cooking) only run
+with --include-writes, since they change the database: cooking uses up the
+sample households' inventory. The delete scenarios remove households and plans
+labelled "bench scratch" that are created just before the first write
+scenario; everything labelled that way is deleted again at the end. The
+/admin/export scenario only runs with --admin-token (default: ADMIN_TOKEN),
+which must match the server's.
+
+bench/baseline.json is a reference run of every scenario, made with
+--include-writes against a bench/generate.py dataset (its size is recorded in
+the file) on one developer machine. Latencies only compare on similar
+hardware; statements per request and errors compare anywhere.
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit
+
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import meal_plans  # noqa: E402
+from bench.common import database_url  # noqa: E402
+
+QUERIES_RE = re.compile(r'db;dur=([\d.]+);desc="(\d+) queries"')
+
+SCRATCH = 'bench scratch'
+
+
+class Sample:
+    """Ids from the benchmark database that scenarios rotate through."""
+
+    def __init__(self, conn, size):
+        self.hids = [r[0] for r in conn.execute(text(
+            "SELECT household_id FROM household ORDER BY household_id LIMIT :n"), {'n': size})]
+        self.plans = conn.execute(text("""
+            SELECT plan_id, household_id FROM meal_plans
+            WHERE household_id = ANY(:hids) ORDER BY plan_id
+        """), {'hids': self.hids}).fetchall()
+        self.rids = [r[0] for r in conn.execute(text(
+            "SELECT recipe_id FROM recipe ORDER BY md5(recipe_id::text) LIMIT :n"), {'n': size})]
+        self.iids = [r[0] for r in conn.execute(text(
+            "SELECT ingredient_id FROM ingredient ORDER BY md5(ingredient_id::text) LIMIT :n"), {'n': size})]
+        middle = conn.execute(text("""
+            SELECT recipe_name, recipe_id FROM recipe
+            ORDER BY recipe_name, recipe_id
+            OFFSET (SELECT count(*) / 2 FROM recipe) LIMIT 1
+        """)).fetchone()
+        self.middle_recipe = middle
+        self.dataset = dict(conn.execute(text("""
+            SELECT 'recipes', count(*) FROM recipe
+            UNION ALL SELECT 'households', count(*) FROM household
+            UNION ALL SELECT 'meal_plans', count(*) FROM meal_plans
+        """)).fetchall())
+        if not self.hids or not self.plans or not self.rids:
+            sys.exit("the benchmark database is empty; run bench/generate.py first")
+        self.admin_token = None
+        # For the delete scenarios, filled in by add_scratch()
+        self.scratch_hids = []
+        self.scratch_plans = []
+
+    def add_scratch(self, conn, n):
+        """Creates n households to delete, and n more with one plan each to delete the plans of."""
+        for _ in range(n):
+            self.scratch_hids.append(conn.execute(text(
+                "INSERT INTO household (household_name) VALUES (:name) RETURNING household_id"
+            ), {'name': SCRATCH}).scalar_one())
+        for _ in range(n):
+            hid = conn.execute(text(
+                "INSERT INTO household (household_name) VALUES (:name) RETURNING household_id"
+            ), {'name': SCRATCH}).scalar_one()
+            self.scratch_plans.append((meal_plans.create_plan(conn, hid, SCRATCH, self.rids[0]), hid))
+
+    def hid(self, i):
+        return self.hids[i % len(self.hids)]
+
+    def plan(self, i):
+        return self.plans[i % len(self.plans)]
+
+    def plans_of(self, hid):
+        return [p.plan_id for p in self.plans if p.household_id == hid]
+
+    def scratch_hid(self):
+        # list.pop is atomic, so concurrent requests never delete the same one
+        return self.scratch_hids.pop()
+
+    def scratch_plan(self):
+        return self.scratch_plans.pop()
+
+
+def remove_scratch(conn):
+    """Deletes the households and plans the write scenarios created (plans' rows go by ON DELETE CASCADE)."""
+    conn.execute(text("DELETE FROM meal_plans WHERE label = :label"), {'label': SCRATCH})
+    conn.execute(text("DELETE FROM household WHERE household_name = :name"), {'name': SCRATCH})
+
+
+def get(path, **params):
+    return ('GET', path + ('?' + urlencode(params, doseq=True) if params else ''), None, {})
+
+
+def post_form(path, **fields):
+    return ('POST', path, urlencode(fields), {'Content-Type': 'application/x-www-form-urlencoded'})
+
+
+def post_json(path, data):
+    return ('POST', path, json.dumps(data), {'Content-Type': 'application/json'})
+
+
+def delete_plan(s):
+    plan_id, hid = s.scratch_plan()
+    return post_form('/mealplans', action='delete', plan_id=plan_id, hid=hid)
+
+
+# name -> (writes?, build(sample, i) -> (method, path, body, headers))
+SCENARIOS = {
+    'index': (False, lambda s, i: get('/')),
+    'recipes': (False, lambda s, i: get('/recipes')),
+    'recipes_next_page': (False, lambda s, i: get('/recipes', after_name=s.middle_recipe.recipe_name,
+                                                  after_id=s.middle_recipe.recipe_id)),
+    'recipes_search': (False, lambda s, i: get('/recipes', q=f"source {i % 97}")),
+    'recipe_typeahead': (False, lambda s, i: get('/api/recipes/search', q='ab')),
+    'households': (False, lambda s, i: get('/households')),
+    'inventory': (False, lambda s, i: get('/inventory', hid=s.hid(i))),
+    'cookable': (False, lambda s, i: get('/cookable', hid=s.hid(i))),
+    'cookable_ranked': (False, lambda s, i: get('/cookable', hid=s.hid(i), mode='ranked', k=20, max_missing=3)),
+    'mealplans': (False, lambda s, i: get('/mealplans', hid=s.hid(i))),
+    'shopping': (False, lambda s, i: get('/shopping', hid=s.hid(i), pid=s.plans_of(s.hid(i))[:3])),
+    'export_plan_csv': (False, lambda s, i: get(f'/export/plans/{s.plan(i).plan_id}/groceries.csv')),
+    'export_household_json_gzip': (False, lambda s, i: get(f'/export/households/{s.hid(i)}/groceries.json', gzip=1)),
+    'recipes_similar': (False, lambda s, i: get('/recipes', similar_to=s.rids[i % len(s.rids)])),
+    'recipe_similar_api': (False, lambda s, i: get(f'/api/recipes/{s.rids[i % len(s.rids)]}/similar')),
+    'ingredient_substitutes': (False, lambda s, i: get(f'/api/ingredients/{s.iids[i % len(s.iids)]}/substitutes',
+                                                       hid=s.hid(i))),
+    'household_stats': (False, lambda s, i: get(f'/api/households/{s.hid(i)}/stats')),
+    'internal_stats': (False, lambda s, i: get('/internal/stats')),
+    'metrics': (False, lambda s, i: get('/metrics')),
+    'healthz': (False, lambda s, i: get('/healthz')),
+    'readyz': (False, lambda s, i: get('/readyz')),
+    'admin_export_csv': (False, lambda s, i: ('GET', '/admin/export/groceries.csv', None,
+                                              {'X-Admin-Token': s.admin_token})),
+    'household_add': (True, lambda s, i: post_form('/households', household_name=SCRATCH)),
+    'household_delete': (True, lambda s, i: post_form('/households', action='delete',
+                                                       household_id=s.scratch_hid())),
+    'inventory_add': (True, lambda s, i: post_form('/inventory', hid=s.hid(i), iid=s.iids[i % len(s.iids)],
+                                                    quantity=1)),
+    'inventory_import_api': (True, lambda s, i: post_json(
+        f'/api/households/{s.hid(i)}/inventory',
+        [{'ingredient_id': iid, 'quantity': 1} for iid in s.iids[:50]])),
+    'mealplan_add_recipe': (True, lambda s, i: post_form('/mealplans', action='add_recipe',
+                                                          plan_id=s.plan(i).plan_id, hid=s.plan(i).household_id,
+                                                          recipe_id=s.rids[i % len(s.rids)])),
+    'mealplan_add_week_api': (True, lambda s, i: post_json(
+        f'/api/mealplans/{s.plan(i).plan_id}/recipes',
+        [{'recipe_id': s.rids[(i + n) % len(s.rids)], 'servings': 2} for n in range(14)])),
+    'mealplan_create': (True, lambda s, i: post_form('/mealplans', hid=s.hid(i), label=SCRATCH,
+                                                      recipe_id=s.rids[i % len(s.rids)])),
+    'mealplan_delete': (True, lambda s, i: delete_plan(s)),
+    'mealplan_cook': (True, lambda s, i: post_form('/mealplans', action='cook', plan_id=s.plan(i).plan_id,
+                                                    hid=s.plan(i).household_id)),
+    'cookable_cook': (True, lambda s, i: post_form('/cookable', hid=s.hid(i), recipe_id=s.rids[i % len(s.rids)])),
+    'cook_api': (True, lambda s, i: post_json(f'/api/households/{s.hid(i)}/cook',
+                                              {'recipes': [s.rids[i % len(s.rids)]]})),
+}
+
+
+class Client:
+    """One keep-alive HTTP connection per worker thread."""
+
+    def __init__(self, server):
+        parts = urlsplit(server)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.local = threading.local()
+
+    def request(self, method, path, body, headers):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            self.local.conn = None
+            raise
+        elapsed = time.perf_counter() - start
+        return response.status, response.getheader('Server-Timing', ''), data, elapsed
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    k = max(0, min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def run_scenario(client, sample, build, requests, concurrency):
+    latencies, queries, db_ms = [], [], []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        try:
+            status, timing, body, elapsed = client.request(*build(sample, i))
+        except Exception:
+            with lock:
+                errors += 1
+            return
+        # Views report database errors as a 200 page starting with <h3>Error. A 409
+        # is the cook API's "not enough in stock" answer, not a failure.
+        failed = (status >= 400 and status != 409) or body.startswith(b'<h3>Error')
+        match = QUERIES_RE.search(timing)
+        with lock:
+            latencies.append(elapsed)
+            errors += failed
+            if match:
+                db_ms.append(float(match.group(1)))
+                queries.append(int(match.group(2)))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': requests,
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / wall, 1) if wall else 0.0,
+        'p50_ms': round(1000 * percentile(latencies, 50), 2),
+        'p95_ms': round(1000 * percentile(latencies, 95), 2),
+        'p99_ms': round(1000 * percentile(latencies, 99), 2),
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        'db_ms_per_request': round(sum(db_ms) / len(db_ms), 2) if db_ms else None,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Returns a list of human-readable regressions against the baseline."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        # Ignore sub-millisecond noise on very fast routes
+        if result['p95_ms'] > base['p95_ms'] * (1 + tolerance) and result['p95_ms'] - base['p95_ms'] > 1:
+            regressions.append(f"{name}: p95 {base['p95_ms']} ms -> {result['p95_ms']} ms")
+        if (result['queries_per_request'] is not None and base.get('queries_per_request') is not None
+                and result['queries_per_request'] > base['queries_per_request'] + 0.5):
+            regressions.append(f"{name}: queries/request {base['queries_per_request']} -> "
+                               f"{result['queries_per_request']}")
+        if result['errors'] > base.get('errors', 0):
+            regressions.append(f"{name}: errors {base.get('errors', 0)} -> {result['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=None, help="benchmark database URL (default: BENCH_DATABASE_URL)")
+    parser.add_argument('--server', default='http://localhost:8111')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help="requests per scenario")
+    parser.add_argument('--sample', type=int, default=20, help="households/recipes to rotate through")
+    parser.add_argument('--only', default=None, help="comma-separated scenario names")
+    parser.add_argument('--include-writes', action='store_true')
+    parser.add_argument('--admin-token', default=os.getenv('ADMIN_TOKEN'),
+                        help="the server's ADMIN_TOKEN, for /admin/export (default: ADMIN_TOKEN)")
+    parser.add_argument('--warmup', type=int, default=10, help="unmeasured requests per scenario")
+    parser.add_argument('--baseline', default=None, help="JSON file from --save-baseline to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed p95 growth (0.2 = 20%%)")
+    parser.add_argument('--save-baseline', default=None, help="write results to this JSON file")
+    args = parser.parse_args()
+
+    engine = create_engine(database_url(args.url))
+    with engine.connect() as conn:
+        sample = Sample(conn, args.sample)
+    sample.admin_token = args.admin_token
+
+    names = args.only.split(',') if args.only else list(SCENARIOS)
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        sys.exit(f"unknown scenarios: {', '.join(unknown)} (known: {', '.join(SCENARIOS)})")
+
+    client = Client(args.server)
+    results = {}
+    print(f"{'scenario':28s} {'rps':>8s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'q/req':>6s} {'errors':>6s}")
+    try:
+        for name in names:
+            writes, build = SCENARIOS[name]
+            if writes and not args.include_writes:
+                continue
+            if name == 'admin_export_csv' and not args.admin_token:
+                continue
+            if writes and not sample.scratch_hids and not sample.scratch_plans:
+                with engine.begin() as conn:
+                    sample.add_scratch(conn, args.warmup + args.requests)
+            run_scenario(client, sample, build, args.warmup, args.concurrency)
+            result = results[name] = run_scenario(client, sample, build, args.requests, args.concurrency)
+            print(f"{name:28s} {result['throughput_rps']:8.1f} {result['p50_ms']:8.2f} {result['p95_ms']:8.2f} "
+                  f"{result['p99_ms']:8.2f} {result['queries_per_request'] or 0:6.1f} {result['errors']:6d}")
+    finally:
+        if args.include_writes:
+            with engine.begin() as conn:
+                remove_scratch(conn)
+        engine.dispose()
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'concurrency': args.concurrency, 'requests': args.requests, 'dataset': sample.dataset,
+                       'results': results},
+                      f, indent=2, sort_keys=True)
+        print(f"saved {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        if regressions:
+            sys.exit(1)
+        print("no regressions against", args.baseline)
+
+
+if __name__ == '__main__':
+    main()
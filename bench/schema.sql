@@ -0,0 +1,68 @@
+-- The tables server.py uses, for a local benchmark database.
+-- Foreign keys from meal plan children are deliberately plain (no cascade)
+-- to match the course database; migrations/ are applied on top of this.
+
+CREATE TABLE household (
+    household_id serial PRIMARY KEY,
+    household_name text NOT NULL
+);
+
+CREATE TABLE ingredient (
+    ingredient_id serial PRIMARY KEY,
+    ingredient_name text NOT NULL UNIQUE,
+    unit text
+);
+
+CREATE TABLE recipe (
+    recipe_id serial PRIMARY KEY,
+    recipe_name text NOT NULL,
+    portion_size integer,
+    source text
+);
+
+CREATE TABLE recipe_made_with_ingredient (
+    recipe_id integer NOT NULL REFERENCES recipe (recipe_id),
+    ingredient_id integer NOT NULL REFERENCES ingredient (ingredient_id),
+    quantity numeric,
+    unit text,
+    PRIMARY KEY (recipe_id, ingredient_id)
+);
+
+CREATE TABLE household_in_inventory_ingredient (
+    household_id integer NOT NULL REFERENCES household (household_id) ON DELETE CASCADE,
+    ingredient_id integer NOT NULL REFERENCES ingredient (ingredient_id),
+    quantity numeric,
+    unit text,
+    PRIMARY KEY (household_id, ingredient_id)
+);
+
+CREATE TABLE meal_plans (
+    plan_id serial PRIMARY KEY,
+    household_id integer NOT NULL REFERENCES household (household_id) ON DELETE CASCADE,
+    label text NOT NULL
+);
+
+CREATE TABLE meal_plan_selects_recipe (
+    plan_id integer NOT NULL REFERENCES meal_plans (plan_id),
+    recipe_id integer NOT NULL REFERENCES recipe (recipe_id),
+    PRIMARY KEY (plan_id, recipe_id)
+);
+
+CREATE TABLE grocery_list (
+    grocery_id serial PRIMARY KEY,
+    plan_id integer NOT NULL REFERENCES meal_plans (plan_id)
+);
+
+CREATE TABLE grocery_list_contains_ingredients (
+    grocery_id integer NOT NULL REFERENCES grocery_list (grocery_id),
+    ingredient_id integer NOT NULL REFERENCES ingredient (ingredient_id),
+    quantity numeric,
+    unit text,
+    PRIMARY KEY (grocery_id, ingredient_id)
+);
+
+-- Used by the example index() view
+CREATE TABLE test (
+    id serial,
+    name text
+);
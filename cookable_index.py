@@ -0,0 +1,167 @@
+"""
+In-process index of which recipes each household can cook.
+
+Every recipe's ingredient requirements are stored as a bitset (a Python int
+with one bit per ingredient), and every household's inventory as another
+bitset. A recipe is cookable when its requirements are a subset of the
+inventory, and its missing ingredient count is the popcount of
+requirements & ~inventory, so /cookable no longer runs the NOT EXISTS anti-join.
+
+The requirements come from the shared recipe x ingredient matrix
+(recipe_matrix.py), which also keeps them as CSR-style NumPy arrays for the
+ranked "almost cookable" mode. Ranking a household compares its inventory
+quantities against every requirement in one vectorized pass and counts
+shortfalls per recipe with np.bincount. Quantities are only compared when the
+recipe uses the ingredient's own unit (the unit inventory is stored in);
+otherwise presence is all that is checked.
+
+Household entries are dropped by the write paths (inventory upsert and
+import, household delete, cooking) and reloaded on the next read. server.py
+sends the drop to every worker process as the reference cache key
+'household:<id>' (see refcache.py). An entry is also reloaded once the
+household's resource version moves past the one it was loaded at (see
+versioning.py), and after COOKABLE_INDEX_TTL seconds (default 300) to pick
+up changes made outside the app.
+"""
+import os
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import queries
+
+RankedRecipe = namedtuple('RankedRecipe', ['recipe_id', 'recipe_name', 'portion_size',
+                                           'missing', 'needed', 'missing_fraction', 'missing_ingredients',
+                                           'missing_ingredient_ids'])
+
+
+class CookableIndex:
+
+    def __init__(self, matrices, version=None, ttl=None):
+        """
+        matrices is the shared recipe_matrix.RecipeMatrices; version(household_id)
+        returns the household's current resource version.
+        """
+        self.matrices = matrices
+        self.version = version
+        self.ttl = ttl if ttl is not None else float(os.getenv("COOKABLE_INDEX_TTL", "300"))
+        self._lock = threading.Lock()
+        self._households = {}       # household_id -> _Household
+
+    def _household(self, conn, household_id):
+        # Read before loading, so the entry is at least as new as its version
+        version = self.version(household_id) if self.version else 0
+        with self._lock:
+            entry = self._households.get(household_id)
+        if entry is not None and entry.version >= version and time.monotonic() - entry.loaded_at <= self.ttl:
+            return entry
+        # Loaded outside the lock, so other households' reads do not wait on this query
+        rows = conn.execute(queries.HOUSEHOLD_INVENTORY, {'hid': household_id}).fetchall()
+        loaded = _Household(rows, version)
+        with self._lock:
+            # A concurrent load may have stored a newer version meanwhile; keep that one
+            entry = self._households.get(household_id)
+            if entry is None or entry.version <= version:
+                entry = self._households[household_id] = loaded
+            return entry
+
+    def missing_counts(self, conn, household_id):
+        """Returns [(recipe, number of required ingredients not in inventory)] ordered by recipe name."""
+        matrix = self.matrices.get(conn)
+        inventory = self._household(conn, int(household_id)).mask(matrix)
+        return [(recipe, (mask & ~inventory).bit_count()) for recipe, mask in zip(matrix.recipes, matrix.masks)]
+
+    def cookable(self, conn, household_id):
+        """Recipes whose every ingredient is in the household's inventory, ordered by name."""
+        return [recipe for recipe, missing in self.missing_counts(conn, household_id) if missing == 0]
+
+    def _shortfalls(self, conn, household_id):
+        """
+        (matrix, short, missing): short flags each requirement the household
+        lacks or has too little of, missing counts them per recipe row.
+        """
+        matrix = self.matrices.get(conn)
+        quantities = self._household(conn, int(household_id)).quantities
+
+        n_cols = len(matrix.ingredient_ids)
+        have = np.zeros(n_cols, dtype=np.float64)
+        present = np.zeros(n_cols, dtype=bool)
+        for ingredient_id, quantity in quantities.items():
+            col = matrix.col_of.get(ingredient_id)
+            if col is not None:
+                have[col] = quantity
+                present[col] = True
+
+        short = ~present[matrix.cols] | (matrix.comparable & (have[matrix.cols] < matrix.qty))
+        missing = np.bincount(matrix.rows, weights=short, minlength=len(matrix.recipes)).astype(np.int64)
+        return matrix, short, missing
+
+    def ranked(self, conn, household_id, k=20, max_missing=None):
+        """
+        Recipes ordered by how many required ingredients are missing or
+        insufficient, then by the fraction missing, then by name.
+        At most k results, optionally only those with missing <= max_missing.
+        """
+        matrix, short, missing = self._shortfalls(conn, household_id)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = np.where(matrix.sizes > 0, missing / matrix.sizes, 0.0)
+
+        # Rows are already in name order, so a stable sort keeps ties alphabetical.
+        order = np.lexsort((fraction, missing))
+        if max_missing is not None:
+            order = order[missing[order] <= max_missing]
+        order = order[:k]
+
+        results = []
+        for row in order:
+            start, end = matrix.indptr[row], matrix.indptr[row + 1]
+            cols = sorted(matrix.cols[start:end][short[start:end]], key=lambda col: matrix.ingredient_names[col])
+            recipe = matrix.recipes[row]
+            results.append(RankedRecipe(recipe.recipe_id, recipe.recipe_name, recipe.portion_size,
+                                        int(missing[row]), int(matrix.sizes[row]), float(fraction[row]),
+                                        [matrix.ingredient_names[col] for col in cols],
+                                        [matrix.ingredient_ids[col] for col in cols]))
+        return results
+
+    def blocking_ingredients(self, conn, household_id, max_missing=1, k=10):
+        """
+        The ingredients that most often keep the household from cooking a
+        recipe: [(ingredient_id, ingredient_name, recipes)], counting only
+        recipes with 1..max_missing missing or insufficient ingredients.
+        """
+        matrix, short, missing = self._shortfalls(conn, household_id)
+        close = (missing > 0) & (missing <= max_missing)
+        counts = np.bincount(matrix.cols[short & close[matrix.rows]], minlength=len(matrix.ingredient_ids))
+        # Most recipes first, ties by name
+        order = sorted(np.flatnonzero(counts), key=lambda col: (-counts[col], matrix.ingredient_names[col]))[:k]
+        return [(matrix.ingredient_ids[col], matrix.ingredient_names[col], int(counts[col])) for col in order]
+
+    def in_stock(self, conn, household_id):
+        """The ingredient ids in the household's inventory."""
+        return set(self._household(conn, int(household_id)).quantities)
+
+    def drop_household(self, household_id):
+        """Called after the household's inventory changes or it is deleted (the next read reloads it)."""
+        with self._lock:
+            self._households.pop(int(household_id), None)
+
+
+class _Household:
+    """One household's inventory: quantities by ingredient, plus its bitset for the current matrix."""
+
+    def __init__(self, rows, version):
+        self.version = version
+        self.quantities = {}
+        for row in rows:
+            self.quantities[row.ingredient_id] = self.quantities.get(row.ingredient_id, 0.0) + float(row.quantity or 0)
+        self.loaded_at = time.monotonic()
+        self._mask = (None, 0)      # (matrix, bitset of the inventory in its columns)
+
+    def mask(self, matrix):
+        built_for, mask = self._mask
+        if built_for is not matrix:
+            mask = matrix.mask(self.quantities)
+            self._mask = (matrix, mask)
+        return mask
@@ -0,0 +1,138 @@
+"""
+Cooking: subtracting recipes' ingredients from a household's inventory.
+
+cook() takes [(recipe_id, servings or None)] (see meal_plans.parse_selections)
+and cook_plan() every recipe of a meal plan. Either runs on the caller's
+transaction in three statements:
+
+1. Lock the household's inventory rows for every needed ingredient with
+   SELECT ... ORDER BY ingredient_id FOR UPDATE. All cooks lock in the same
+   order, so two concurrent cooks in one household queue up instead of
+   deadlocking.
+2. Compare what is needed with the locked stock. If anything is missing or
+   short nothing changes, and the shortfalls are returned; the caller rolls
+   back to release the locks.
+3. Subtract everything in one statement: an UPDATE joined against
+   recipe_made_with_ingredient, plus a DELETE of the rows that are used up
+   exactly, so they stop counting as in stock for /cookable.
+
+Quantities scale with servings / portion_size as in meal_plans.py and are
+converted to the unit the household stocks through unit_conversion (as in
+shopping.py). Where the units cannot be converted, or the stock has no
+quantity, only the ingredient's presence is checked and its stock is left alone.
+"""
+from collections import namedtuple
+
+from sqlalchemy import text
+
+Shortfall = namedtuple('Shortfall', ['ingredient_id', 'ingredient_name', 'unit', 'needed', 'in_stock'])
+
+# Per needed ingredient: quantity in the household's unit (NULL when it cannot
+# be measured) and the household's stock row (stocked is false when there is none)
+NEEDS = """
+    WITH picked AS (
+        SELECT p.recipe_id,
+               SUM(COALESCE(p.servings / NULLIF(r.portion_size, 0), 1)) AS multiplier
+        FROM unnest(CAST(:rids AS integer[]), CAST(:servings AS numeric[])) AS p (recipe_id, servings)
+        JOIN recipe r ON r.recipe_id = p.recipe_id
+        GROUP BY p.recipe_id
+    ), required AS (
+        SELECT ri.ingredient_id, lower(trim(ri.unit)) AS unit, SUM(COALESCE(ri.quantity, 0) * p.multiplier) AS quantity
+        FROM picked p
+        JOIN recipe_made_with_ingredient ri ON ri.recipe_id = p.recipe_id
+        GROUP BY 1, 2
+    ), needs AS (
+        SELECT rq.ingredient_id,
+               hi.ingredient_id IS NOT NULL AS stocked,
+               hi.quantity AS in_stock,
+               hi.unit,
+               SUM(CASE WHEN rq.unit = lower(trim(hi.unit)) THEN rq.quantity
+                        WHEN fc.base_unit = tc.base_unit THEN rq.quantity * fc.factor / tc.factor
+                   END) AS quantity
+        FROM required rq
+        LEFT JOIN household_in_inventory_ingredient hi
+               ON hi.household_id = :hid AND hi.ingredient_id = rq.ingredient_id
+        LEFT JOIN unit_conversion fc ON fc.unit = rq.unit
+        LEFT JOIN unit_conversion tc ON tc.unit = lower(trim(hi.unit))
+        GROUP BY rq.ingredient_id, hi.ingredient_id, hi.quantity, hi.unit
+    )
+"""
+
+LOCK_QUERY = text("""
+    SELECT ingredient_id
+    FROM household_in_inventory_ingredient
+    WHERE household_id = :hid
+      AND ingredient_id IN (SELECT ingredient_id FROM recipe_made_with_ingredient
+                            WHERE recipe_id = ANY(CAST(:rids AS integer[])))
+    ORDER BY ingredient_id
+    FOR UPDATE
+""")
+
+SHORTFALL_QUERY = text(NEEDS + """
+    SELECT n.ingredient_id, i.ingredient_name, COALESCE(n.unit, i.unit) AS unit, n.quantity AS needed,
+           CASE WHEN n.stocked THEN n.in_stock ELSE 0 END AS in_stock
+    FROM needs n
+    JOIN ingredient i ON i.ingredient_id = n.ingredient_id
+    WHERE NOT n.stocked OR n.in_stock < n.quantity
+    ORDER BY i.ingredient_name
+""")
+
+CONSUME_QUERY = text(NEEDS + """
+    , used_up AS (
+        DELETE FROM household_in_inventory_ingredient hi
+        USING needs n
+        WHERE hi.household_id = :hid AND hi.ingredient_id = n.ingredient_id
+          AND hi.quantity <= n.quantity
+        RETURNING hi.ingredient_id, CAST(0 AS numeric) AS quantity
+    ), reduced AS (
+        UPDATE household_in_inventory_ingredient hi
+        SET quantity = hi.quantity - n.quantity
+        FROM needs n
+        WHERE hi.household_id = :hid AND hi.ingredient_id = n.ingredient_id
+          AND hi.quantity > n.quantity
+        RETURNING hi.ingredient_id, hi.quantity
+    )
+    SELECT ingredient_id, quantity FROM used_up
+    UNION ALL
+    SELECT ingredient_id, quantity FROM reduced
+""")
+
+
+def cook(conn, household_id, selections):
+    """
+    Cooks [(recipe_id, servings or None)] on conn's transaction. Returns
+    ({ingredient_id: quantity left}, []) or, when the household is short of
+    anything, ({}, [Shortfall]) with the inventory unchanged.
+    """
+    if not selections:
+        return {}, []
+    params = {'hid': int(household_id),
+              'rids': [recipe_id for recipe_id, _ in selections],
+              'servings': [servings for _, servings in selections]}
+    conn.execute(LOCK_QUERY, params)
+    shortfalls = [Shortfall(*row) for row in conn.execute(SHORTFALL_QUERY, params)]
+    if shortfalls:
+        return {}, shortfalls
+    return dict(conn.execute(CONSUME_QUERY, params).fetchall()), []
+
+
+def cook_plan(conn, household_id, plan_id):
+    """cook() every recipe of one of the household's meal plans, one portion each."""
+    recipe_ids = conn.execute(text("""
+        SELECT mpsr.recipe_id
+        FROM meal_plans mp
+        JOIN meal_plan_selects_recipe mpsr ON mpsr.plan_id = mp.plan_id
+        WHERE mp.plan_id = :pid AND mp.household_id = :hid
+        ORDER BY mpsr.recipe_id
+    """), {'pid': int(plan_id), 'hid': int(household_id)}).scalars().all()
+    if not recipe_ids:
+        raise ValueError(f"meal plan {plan_id} has no recipes in household {household_id}")
+    return cook(conn, household_id, [(recipe_id, None) for recipe_id in recipe_ids])
+
+
+def describe(shortfalls):
+    """One line per shortfall, for error pages."""
+    return '\n'.join(
+        f"{s.ingredient_name}: none in stock" if s.needed is None else
+        f"{s.ingredient_name}: need {float(s.needed):g}, have {float(s.in_stock):g} {s.unit or ''}".rstrip()
+        for s in shortfalls)
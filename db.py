@@ -0,0 +1,252 @@
+"""
+Database connection management for the webserver.
+
+The engine uses the psycopg 3 driver and a QueuePool sized from the
+DATABASE_POOL_* variables in .env. Its connections prepare the statements they
+run repeatedly on the server (DATABASE_PREPARE_THRESHOLD, see queries.py).
+Connections are checked out lazily: a request only takes a connection from the
+pool the first time a view reads g.conn, so static files, redirects and error
+pages never touch the database. Each worker process creates its own engine
+(see create_app in server.py), and dispose_all drains the pool on shutdown.
+
+Read replicas are optional. With DATABASE_REPLICA_HOSTS set, GET and HEAD
+requests read from a randomly chosen replica and everything else uses the
+primary. A request that is not a GET (a form POST, an API write) sets a
+short-lived cookie that keeps that browser on the primary for
+DATABASE_STICKY_SECONDS, so the page it is redirected to shows its own write
+even if the replicas lag behind. primary() gives a read request a primary
+connection for data that is cached across requests.
+"""
+import os
+import random
+import threading
+import time
+
+from flask import current_app, g, request
+from flask.ctx import _AppCtxGlobals
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+def _env_bool(name, default):
+    value = os.getenv(name)
+    if value in (None, ""):
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def pool_options_from_env():
+    """
+    Pool settings read from the environment (all optional):
+
+        DATABASE_POOL_SIZE       connections kept open (default 5)
+        DATABASE_MAX_OVERFLOW    extra connections allowed under load (default 10)
+        DATABASE_POOL_RECYCLE    seconds before a connection is replaced (default 1800)
+        DATABASE_POOL_PRE_PING   test connections on checkout (default true)
+        DATABASE_POOL_TIMEOUT    seconds to wait for a free connection (default 10)
+    """
+    return {
+        'pool_size': _env_int("DATABASE_POOL_SIZE", 5),
+        'max_overflow': _env_int("DATABASE_MAX_OVERFLOW", 10),
+        'pool_recycle': _env_int("DATABASE_POOL_RECYCLE", 1800),
+        'pool_pre_ping': _env_bool("DATABASE_POOL_PRE_PING", True),
+        'pool_timeout': _env_float("DATABASE_POOL_TIMEOUT", 10),
+    }
+
+
+def prepare_threshold_from_env():
+    """
+    DATABASE_PREPARE_THRESHOLD: how many times a psycopg 3 connection runs a
+    statement before preparing it server-side (default 1; 0 prepares on first
+    use). "off" disables prepared statements, e.g. behind a transaction-pooling
+    PgBouncer.
+    """
+    value = os.getenv("DATABASE_PREPARE_THRESHOLD")
+    if value in (None, ""):
+        return 1
+    if value.strip().lower() in ("off", "none", "false"):
+        return None
+    return int(value)
+
+
+def replica_hosts_from_env():
+    """DATABASE_REPLICA_HOSTS: comma-separated host[:port] of read replicas (default none)."""
+    return [host.strip() for host in os.getenv("DATABASE_REPLICA_HOSTS", "").split(",") if host.strip()]
+
+
+STICKY_COOKIE = 'db_primary'
+
+
+_engines = []
+
+
+def psycopg_uri(uri):
+    """postgresql://... with the psycopg 3 driver (SQLAlchemy's default for postgresql:// is psycopg2)."""
+    scheme, sep, rest = uri.partition('://')
+    return f"{scheme.split('+')[0]}+psycopg{sep}{rest}"
+
+
+def create_db_engine(uri):
+    """
+    Creating an engine does not connect; the first connection is made when a
+    request first needs one. An engine inherited across fork() (e.g. gunicorn
+    with --preload) drops the parent's connections in the child instead of
+    sharing their sockets.
+    """
+    engine = create_engine(psycopg_uri(uri), connect_args={'prepare_threshold': prepare_threshold_from_env()},
+                           **pool_options_from_env())
+    _engines.append(engine)
+    return engine
+
+
+def _after_fork():
+    for engine in _engines:
+        engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def dispose_all():
+    """Closes every pooled connection; called when a worker shuts down."""
+    for engine in _engines:
+        engine.dispose()
+
+
+class PoolStats:
+    """Counters for how long requests wait to check out a connection."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_checkout(self, wait):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self, engine):
+        pool = engine.pool
+        opts = pool_options_from_env()
+        capacity = opts['pool_size'] + max(opts['max_overflow'], 0)
+        checked_out = pool.checkedout()
+        with self._lock:
+            return {
+                'pool_size': pool.size(),
+                'max_overflow': opts['max_overflow'],
+                'checked_out': checked_out,
+                'checked_in': pool.checkedin(),
+                'overflow': pool.overflow(),
+                'saturation': round(checked_out / capacity, 3) if capacity else None,
+                'checkouts': self.checkouts,
+                'checkout_timeouts': self.timeouts,
+                'checkout_wait_avg_ms': round(1000 * self.wait_total / self.checkouts, 3) if self.checkouts else 0.0,
+                'checkout_wait_max_ms': round(1000 * self.wait_max, 3),
+            }
+
+
+pool_stats = PoolStats()
+
+
+def get_engine():
+    return current_app.extensions['db_engine']
+
+
+def read_replica():
+    """
+    Index of the replica this request reads from, or None for the primary.
+    Chosen once per request.
+    """
+    if '_read_replica' not in g:
+        replicas = current_app.extensions['db_replicas']
+        use_replica = (replicas and request.method in ('GET', 'HEAD')
+                       and STICKY_COOKIE not in request.cookies)
+        g._read_replica = random.randrange(len(replicas)) if use_replica else None
+    return g._read_replica
+
+
+def read_engine():
+    """The engine this request reads from (see read_replica)."""
+    replica = read_replica()
+    return get_engine() if replica is None else current_app.extensions['db_replicas'][replica]
+
+
+def checkout(engine=None):
+    """Takes a connection from engine's pool (default the primary), recording how long the checkout waited."""
+    start = time.perf_counter()
+    try:
+        conn = (engine or get_engine()).connect()
+    except PoolTimeoutError:
+        pool_stats.record_timeout()
+        raise
+    pool_stats.record_checkout(time.perf_counter() - start)
+    return conn
+
+
+class LazyConnGlobals(_AppCtxGlobals):
+    """
+    Flask's g object, except that g.conn (from read_engine()) and
+    g.primary_conn are only checked out of the pool the first time a view
+    reads them.
+    """
+
+    def __getattr__(self, name):
+        if name == 'conn':
+            conn = self.conn = checkout(read_engine())
+        elif name == 'primary_conn':
+            conn = self.primary_conn = self.conn if read_replica() is None else checkout()
+        else:
+            return super().__getattr__(name)
+        return conn
+
+
+def primary():
+    """
+    A connection to the primary: g.conn when this request already uses the
+    primary, otherwise one more connection. For loads that are cached across
+    requests, which must not come from a replica that is behind.
+    """
+    return g.primary_conn
+
+
+def close_request_connections():
+    """Returns the request's connections to their pools."""
+    primary_conn = g.pop('primary_conn', None)
+    conn = g.pop('conn', None)
+    for c in {id(c): c for c in (conn, primary_conn) if c is not None}.values():
+        try:
+            c.close()
+        except Exception:
+            pass
+
+
+def _stick_to_primary(response):
+    if current_app.extensions['db_replicas'] and request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        response.set_cookie(STICKY_COOKIE, '1', max_age=_env_int("DATABASE_STICKY_SECONDS", 5),
+                            httponly=True, samesite='Lax')
+    return response
+
+
+def init_app(app, engine, replicas=()):
+    app.extensions['db_engine'] = engine
+    app.extensions['db_replicas'] = list(replicas)
+    app.app_ctx_globals_class = LazyConnGlobals
+    app.after_request(_stick_to_primary)
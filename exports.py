@@ -0,0 +1,110 @@
+"""
+Streaming CSV/JSON exports of grocery lists.
+
+Rows are read through a server-side (named) cursor in batches of
+EXPORT_BATCH_SIZE and encoded as they arrive, optionally gzip-compressed on
+the fly, so memory use does not depend on how many rows are exported.
+A streamed response outlives the view function (and the request's g.conn),
+so each export checks out its own connection (from a read replica when
+there are any) for as long as it is streaming.
+"""
+import csv
+import io
+import json
+import zlib
+from decimal import Decimal
+
+from flask import Response, stream_with_context
+from sqlalchemy import text
+
+import db
+
+EXPORT_BATCH_SIZE = 1000
+
+GROCERY_COLUMNS = ['household_id', 'household_name', 'plan_id', 'label',
+                   'ingredient_id', 'ingredient_name', 'quantity', 'unit']
+
+GROCERY_QUERY = """
+    SELECT mp.household_id, h.household_name, mp.plan_id, mp.label,
+           i.ingredient_id, i.ingredient_name, gci.quantity, gci.unit
+    FROM meal_plans mp
+    JOIN household h ON h.household_id = mp.household_id
+    JOIN grocery_list gl ON gl.plan_id = mp.plan_id
+    JOIN grocery_list_contains_ingredients gci ON gci.grocery_id = gl.grocery_id
+    JOIN ingredient i ON i.ingredient_id = gci.ingredient_id
+    {where}
+    ORDER BY mp.household_id, mp.plan_id, i.ingredient_name
+"""
+
+
+def stream_batches(sql, params=None):
+    """Yields lists of rows from a server-side cursor, EXPORT_BATCH_SIZE at a time."""
+    conn = db.checkout(db.read_engine())
+    try:
+        result = conn.execution_options(yield_per=EXPORT_BATCH_SIZE).execute(text(sql), params or {})
+        for batch in result.partitions():
+            yield batch
+        result.close()
+    finally:
+        conn.close()
+
+
+def csv_chunks(batches, columns):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows(batch)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue()
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def json_chunks(batches, columns):
+    yield '['
+    first = True
+    for batch in batches:
+        parts = []
+        for row in batch:
+            parts.append(('' if first else ',') + json.dumps(dict(zip(columns, row)), default=_json_default))
+            first = False
+        yield ''.join(parts)
+    yield ']'
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)  # 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_response(sql, params, columns, fmt, filename, gzip=False):
+    """A streamed (chunked) download of the query's rows as fmt ('csv' or 'json')."""
+    batches = stream_batches(sql, params)
+    if fmt == 'json':
+        chunks, mimetype = json_chunks(batches, columns), 'application/json'
+    else:
+        chunks, mimetype = csv_chunks(batches, columns), 'text/csv'
+
+    headers = {'Content-Disposition': f'attachment; filename="{filename}.{fmt}"'}
+    if gzip:
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    else:
+        chunks = (chunk.encode('utf-8') for chunk in chunks)
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
+
+
+def grocery_export(fmt, filename, where='', params=None, gzip=False):
+    return export_response(GROCERY_QUERY.format(where=where), params,
+                           GROCERY_COLUMNS, fmt, filename, gzip=gzip)
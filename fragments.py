@@ -0,0 +1,69 @@
+"""
+Cache of rendered HTML fragments (plan cards, <select> option lists).
+
+Keys name the fragment and the versions of the data it shows, so a changed
+plan simply gets a new key and its old card ages out. Fragments built from a
+reference cache list (households, ingredients) are also tied to that list
+object: a reload of the list is a miss even before any version moves.
+
+Entries are evicted least recently used first once their total size passes
+FRAGMENT_CACHE_BYTES (default 8 MB). The cache is per process.
+"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+
+class FragmentCache:
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv("FRAGMENT_CACHE_BYTES", 8 * 1024 * 1024))
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (html, source, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, source=None):
+        """The cached fragment for key, or None. source must be the object it was rendered from."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] is not source:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, html, source=None):
+        html = Markup(html)
+        size = sys.getsizeof(str(html))
+        if size > self.max_bytes:
+            return html
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self._entries[key] = (html, source, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+        return html
+
+    def render(self, key, render, source=None):
+        """The cached fragment for key, calling render() to build it on a miss."""
+        html = self.get(key, source)
+        if html is None:
+            html = self.put(key, render(), source)
+        return html
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
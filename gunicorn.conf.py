@@ -0,0 +1,42 @@
+"""
+Production server settings:
+
+    gunicorn -c gunicorn.conf.py
+
+Each worker process imports server.py after fork and builds its own app and
+connection pool with create_app(), so every worker holds up to
+DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW connections. On SIGTERM gunicorn
+stops accepting connections, lets in-flight requests finish (up to
+GUNICORN_GRACEFUL_TIMEOUT seconds) and each worker then closes its pool.
+
+    WEB_CONCURRENCY           worker processes (default: 2 x CPUs + 1)
+    GUNICORN_THREADS          threads per worker (default 4)
+    HOST, PORT                bind address (default 0.0.0.0:8111)
+    GUNICORN_TIMEOUT          seconds before a stuck worker is restarted (default 60)
+    GUNICORN_GRACEFUL_TIMEOUT seconds to finish requests on shutdown (default 30)
+"""
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+wsgi_app = "server:create_app()"
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '8111')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+worker_class = "gthread"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+# Import the app in each worker, after fork, rather than once in the master
+preload_app = False
+accesslog = "-"
+
+
+def worker_exit(server, worker):
+    import aio
+    import db
+    aio.dispose_all()
+    db.dispose_all()
@@ -0,0 +1,142 @@
+"""
+Bulk inventory import for a household.
+
+Rows come from a CSV upload or a JSON list and name an ingredient (by id or
+by name) and a quantity to add. Rows that cannot be parsed or that name an
+unknown ingredient are reported back with their line number; the rest are
+imported. The database work is a fixed number of statements however many
+rows there are: the rows are COPYed into a temp table, names are resolved
+with one UPDATE ... FROM ingredient, and everything is merged into
+household_in_inventory_ingredient with one INSERT ... ON CONFLICT that takes
+the unit from the ingredient table.
+
+CSV files need a header row with a quantity column and one of
+ingredient_id, ingredient_name or ingredient:
+
+    ingredient,quantity
+    flour,500
+    12,3
+"""
+import csv
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import text
+
+# Largest value of the integer ingredient_id column
+_MAX_ID = 2**31 - 1
+
+
+def parse_csv(stream):
+    """Returns (rows, errors) from a CSV text stream."""
+    reader = csv.DictReader(stream)
+    if not reader.fieldnames or 'quantity' not in reader.fieldnames:
+        return [], [{'line': 1, 'error': "header must include 'quantity' and 'ingredient'"}]
+    # Line 1 is the header
+    return _parse_records(enumerate(reader, start=2))
+
+
+def parse_json(data):
+    """Returns (rows, errors) from a decoded JSON list of objects."""
+    if not isinstance(data, list):
+        return [], [{'line': 0, 'error': 'expected a JSON list of {ingredient, quantity} objects'}]
+    return _parse_records(enumerate(data, start=1))
+
+
+def _parse_records(records):
+    rows, errors = [], []
+    for line, record in records:
+        if not isinstance(record, dict):
+            errors.append({'line': line, 'error': 'expected an object'})
+            continue
+        ingredient = record.get('ingredient_id') or record.get('ingredient_name') or record.get('ingredient')
+        ingredient = str(ingredient).strip() if ingredient is not None else ''
+        if not ingredient:
+            errors.append({'line': line, 'error': 'missing ingredient'})
+            continue
+        try:
+            quantity = Decimal(str(record.get('quantity')).strip())
+        except InvalidOperation:
+            errors.append({'line': line, 'error': f"invalid quantity {record.get('quantity')!r}"})
+            continue
+        if not quantity.is_finite() or quantity <= 0:
+            errors.append({'line': line, 'error': 'quantity must be a positive number'})
+            continue
+        if ingredient.isdecimal():
+            # Out of range would fail the COPY, and with it the whole batch
+            if int(ingredient) > _MAX_ID:
+                errors.append({'line': line, 'error': f"unknown ingredient {ingredient!r}"})
+                continue
+            rows.append((line, int(ingredient), None, quantity))
+        else:
+            rows.append((line, None, ingredient, quantity))
+    return rows, errors
+
+
+def _copy_rows(conn, rows):
+    """Streams rows into the inventory_import temp table with COPY (psycopg 3's cursor.copy)."""
+    with conn.connection.driver_connection.cursor() as cursor:
+        with cursor.copy("""
+            COPY inventory_import (line, ingredient_id, ingredient_name, quantity) FROM STDIN
+        """) as copy:
+            for row in rows:
+                copy.write_row(row)
+
+
+def import_inventory(conn, household_id, rows):
+    """
+    Adds rows to the household's inventory on conn's transaction (the caller
+    commits). Returns ({ingredient_id: quantity added}, errors for unknown ingredients).
+    """
+    if not rows:
+        return {}, []
+
+    conn.execute(text("""
+        CREATE TEMP TABLE inventory_import (
+            line integer,
+            ingredient_id integer,
+            ingredient_name text,
+            quantity numeric
+        ) ON COMMIT DROP
+    """))
+    _copy_rows(conn, rows)
+
+    # Resolve names, then report anything that still does not match an ingredient
+    conn.execute(text("""
+        UPDATE inventory_import t
+        SET ingredient_id = i.ingredient_id
+        FROM ingredient i
+        WHERE t.ingredient_id IS NULL
+          AND lower(i.ingredient_name) = lower(t.ingredient_name)
+    """))
+    unknown = conn.execute(text("""
+        SELECT t.line, COALESCE(t.ingredient_id::text, t.ingredient_name) AS ingredient
+        FROM inventory_import t
+        WHERE NOT EXISTS (SELECT 1 FROM ingredient i WHERE i.ingredient_id = t.ingredient_id)
+        ORDER BY t.line
+    """)).fetchall()
+    errors = [{'line': row.line, 'error': f"unknown ingredient {row.ingredient!r}"} for row in unknown]
+
+    # Duplicate ingredients in one batch are summed first, since ON CONFLICT
+    # cannot update the same row twice in one statement
+    merged = conn.execute(text("""
+        WITH batch AS (
+            SELECT t.ingredient_id, SUM(t.quantity) AS quantity
+            FROM inventory_import t
+            JOIN ingredient i ON i.ingredient_id = t.ingredient_id
+            GROUP BY t.ingredient_id
+        ), upserted AS (
+            INSERT INTO household_in_inventory_ingredient (household_id, ingredient_id, quantity, unit)
+            SELECT :hid, b.ingredient_id, b.quantity, i.unit
+            FROM batch b
+            JOIN ingredient i ON i.ingredient_id = b.ingredient_id
+            ON CONFLICT (household_id, ingredient_id)
+            DO UPDATE SET quantity = household_in_inventory_ingredient.quantity + EXCLUDED.quantity,
+                          unit = EXCLUDED.unit
+            RETURNING ingredient_id
+        )
+        SELECT b.ingredient_id, b.quantity
+        FROM batch b
+        JOIN upserted u ON u.ingredient_id = b.ingredient_id
+    """), {'hid': household_id}).fetchall()
+
+    return {row.ingredient_id: row.quantity for row in merged}, errors
@@ -0,0 +1,120 @@
+"""
+Meal plan writes, each a single statement (one round trip).
+
+create_plan inserts the plan, its first recipe, its grocery list and the
+grocery lines in one data-modifying CTE. delete_plan is one DELETE that relies
+on the ON DELETE CASCADE foreign keys from migrations/003_meal_plan_cascades.sql.
+add_recipes links any number of recipes with INSERT ... ON CONFLICT DO NOTHING
+RETURNING and merges the ingredients of the newly linked ones into the grocery
+list with one aggregated upsert, so re-adding a recipe (or two concurrent adds
+of the same recipe) cannot double its ingredients.
+
+Each recipe can come with a number of servings; its ingredient quantities are
+scaled by servings / portion_size. Without servings the recipe counts once.
+"""
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import text
+
+
+def create_plan(conn, household_id, label, recipe_id):
+    """Returns the new plan_id."""
+    return conn.execute(text("""
+        WITH plan AS (
+            INSERT INTO meal_plans (household_id, label)
+            VALUES (:hid, :label)
+            RETURNING plan_id
+        ), link AS (
+            INSERT INTO meal_plan_selects_recipe (plan_id, recipe_id)
+            SELECT plan_id, CAST(:rid AS integer) FROM plan
+        ), grocery AS (
+            INSERT INTO grocery_list (plan_id)
+            SELECT plan_id FROM plan
+            RETURNING grocery_id
+        ), lines AS (
+            INSERT INTO grocery_list_contains_ingredients (grocery_id, ingredient_id, quantity, unit)
+            SELECT grocery.grocery_id, ri.ingredient_id, ri.quantity, ri.unit
+            FROM grocery
+            CROSS JOIN recipe_made_with_ingredient ri
+            WHERE ri.recipe_id = :rid
+        )
+        SELECT plan_id FROM plan
+    """), {'hid': household_id, 'label': label, 'rid': recipe_id}).scalar_one()
+
+
+def delete_plan(conn, plan_id):
+    """Deletes the plan and (by cascade) everything hanging off it. Returns True if it existed."""
+    return conn.execute(text("""
+        DELETE FROM meal_plans WHERE plan_id = :pid
+    """), {'pid': plan_id}).rowcount > 0
+
+
+def parse_selections(recipe_ids, servings=()):
+    """
+    Pairs recipe ids with their (optional) servings, e.g. from request.form.getlist.
+    Blank servings mean one portion. Raises ValueError for anything unparseable.
+    """
+    servings = list(servings) + [None] * (len(recipe_ids) - len(servings))
+    selections = []
+    for recipe_id, amount in zip(recipe_ids, servings):
+        try:
+            recipe_id = int(recipe_id)
+        except (TypeError, ValueError):
+            raise ValueError(f"invalid recipe id {recipe_id!r}")
+        if amount is None or str(amount).strip() == '':
+            selections.append((recipe_id, None))
+            continue
+        try:
+            amount = Decimal(str(amount).strip())
+        except InvalidOperation:
+            raise ValueError(f"invalid servings {amount!r}")
+        if not amount.is_finite() or amount <= 0:
+            raise ValueError("servings must be a positive number")
+        selections.append((recipe_id, amount))
+    return selections
+
+
+def add_recipes(conn, plan_id, selections):
+    """
+    Adds [(recipe_id, servings or None)] to a plan in one statement. Recipes
+    already in the plan are skipped; a recipe listed twice has its servings
+    added up. Returns the ids of the recipes that were added. Raises
+    LookupError if the plan does not exist.
+    """
+    if not selections:
+        return []
+    plan_exists, added = conn.execute(text("""
+        WITH plan AS (
+            SELECT plan_id FROM meal_plans WHERE plan_id = CAST(:pid AS integer)
+        ), picked AS (
+            SELECT p.recipe_id,
+                   SUM(COALESCE(p.servings / NULLIF(r.portion_size, 0), 1)) AS multiplier
+            FROM unnest(CAST(:rids AS integer[]), CAST(:servings AS numeric[])) AS p (recipe_id, servings)
+            JOIN recipe r ON r.recipe_id = p.recipe_id
+            GROUP BY p.recipe_id
+        ), link AS (
+            INSERT INTO meal_plan_selects_recipe (plan_id, recipe_id)
+            SELECT plan.plan_id, picked.recipe_id FROM plan CROSS JOIN picked
+            ON CONFLICT (plan_id, recipe_id) DO NOTHING
+            RETURNING recipe_id
+        ), lines AS (
+            -- Summed per ingredient first, since ON CONFLICT cannot update
+            -- the same row twice in one statement
+            INSERT INTO grocery_list_contains_ingredients (grocery_id, ingredient_id, quantity, unit)
+            SELECT gl.grocery_id, ri.ingredient_id, SUM(ri.quantity * p.multiplier), MIN(ri.unit)
+            FROM link
+            JOIN picked p ON p.recipe_id = link.recipe_id
+            JOIN recipe_made_with_ingredient ri ON ri.recipe_id = link.recipe_id
+            JOIN grocery_list gl ON gl.plan_id = CAST(:pid AS integer)
+            GROUP BY gl.grocery_id, ri.ingredient_id
+            ON CONFLICT (grocery_id, ingredient_id)
+            DO UPDATE SET quantity = grocery_list_contains_ingredients.quantity + EXCLUDED.quantity
+        )
+        SELECT EXISTS (SELECT 1 FROM plan), ARRAY(SELECT recipe_id FROM link ORDER BY recipe_id)
+    """), {'pid': plan_id,
+           'rids': [recipe_id for recipe_id, _ in selections],
+           'servings': [servings for _, servings in selections]}).one()
+    if not plan_exists:
+        raise LookupError(f"meal plan {plan_id} does not exist")
+    return added
+
@@ -0,0 +1,204 @@
+"""
+Per-request SQL instrumentation and Prometheus metrics.
+
+SQLAlchemy cursor events time every statement. Each request counts its
+statements, their total time and the slowest one, and reports them in a
+Server-Timing header (visible in the browser's network tab):
+
+    Server-Timing: db;dur=12.4;desc="5 queries", db-slowest;dur=6.1, app;dur=30.2
+
+The same numbers feed histograms per endpoint that /metrics serves in the
+Prometheus text format. Statements slower than SLOW_QUERY_MS milliseconds
+(unset = off) are logged with the endpoint that ran them.
+
+Metrics are kept per process. Statements that aio.py runs on its event loop
+thread are credited to the request that started them.
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+
+log = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram:
+    """A Prometheus histogram with a fixed label set."""
+
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, *label_values):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for label_values, series in items:
+            labels = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labels, label_values))
+            prefix = labels + ',' if labels else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            cumulative += series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {series[-1]}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return '\n'.join(lines)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Flask request latency',
+                            ('endpoint', 'method', 'status'), LATENCY_BUCKETS)
+STATEMENT_SECONDS = Histogram('sql_statement_duration_seconds', 'Duration of individual SQL statements',
+                              ('endpoint',), LATENCY_BUCKETS)
+REQUEST_STATEMENTS = Histogram('sql_statements_per_request', 'SQL statements issued per request',
+                               ('endpoint',), COUNT_BUCKETS)
+REQUEST_SQL_SECONDS = Histogram('sql_duration_per_request_seconds', 'Total SQL time per request',
+                                ('endpoint',), LATENCY_BUCKETS)
+REQUEST_SLOWEST_SECONDS = Histogram('sql_slowest_statement_per_request_seconds',
+                                    'Slowest SQL statement per request', ('endpoint',), LATENCY_BUCKETS)
+
+HISTOGRAMS = [REQUEST_SECONDS, STATEMENT_SECONDS, REQUEST_STATEMENTS, REQUEST_SQL_SECONDS, REQUEST_SLOWEST_SECONDS]
+
+
+class RequestStats:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.slowest = 0.0
+
+
+def _current_stats():
+    return g.get('_request_stats') if has_app_context() else None
+
+
+def _endpoint():
+    try:
+        return request.endpoint or 'none'
+    except RuntimeError:
+        return 'none'
+
+
+def request_context():
+    """The current request's stats and endpoint, for statements run outside its thread."""
+    return _current_stats(), _endpoint()
+
+
+def bind_connection(conn, context):
+    """
+    Credits statements on conn (a sync Connection) to the request context
+    came from; bind_connection(conn, None) unbinds it before it goes back to
+    the pool.
+    """
+    if context is None:
+        conn.info.pop('request_context', None)
+    else:
+        conn.info['request_context'] = context
+
+
+def _statement_request(conn):
+    if has_app_context():
+        return _current_stats(), _endpoint()
+    return conn.info.get('request_context') or (None, 'none')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    stats, endpoint = _statement_request(conn)
+    STATEMENT_SECONDS.observe(elapsed, endpoint)
+
+    if stats is not None:
+        stats.statements += 1
+        stats.sql_seconds += elapsed
+        stats.slowest = max(stats.slowest, elapsed)
+
+    slow_ms = os.getenv("SLOW_QUERY_MS")
+    if slow_ms and elapsed * 1000 >= float(slow_ms):
+        log.warning("slow query (%.1f ms) in %s: %s", elapsed * 1000, endpoint, ' '.join(statement.split())[:500])
+
+
+def _handle_error(context):
+    # after_cursor_execute does not run for a failed statement
+    if context.connection is not None and context.connection.info.get('query_start'):
+        context.connection.info['query_start'].pop()
+
+
+def _before_request():
+    g._request_stats = RequestStats()
+
+
+def _after_request(response):
+    stats = _current_stats()
+    if stats is None:
+        return response
+    total = time.perf_counter() - stats.start
+    endpoint = _endpoint()
+    REQUEST_SECONDS.observe(total, endpoint, request.method, response.status_code)
+    REQUEST_STATEMENTS.observe(stats.statements, endpoint)
+    REQUEST_SQL_SECONDS.observe(stats.sql_seconds, endpoint)
+    REQUEST_SLOWEST_SECONDS.observe(stats.slowest, endpoint)
+    response.headers.add('Server-Timing',
+                         f'db;dur={stats.sql_seconds * 1000:.1f};desc="{stats.statements} queries", '
+                         f'db-slowest;dur={stats.slowest * 1000:.1f}, app;dur={total * 1000:.1f}')
+    return response
+
+
+def render(extra=()):
+    """All histograms, plus any extra pre-rendered metric blocks, in Prometheus text format."""
+    return '\n'.join([h.render() for h in HISTOGRAMS] + list(extra)) + '\n'
+
+
+def gauge(name, help, value):
+    return f"# HELP {name} {help}\n# TYPE {name} gauge\n{name} {value}"
+
+
+def counter(name, help, values, label):
+    """A counter block from {label value: count}."""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} counter"]
+    lines += [f'{name}{{{label}="{_escape(k)}"}} {v}' for k, v in sorted(values.items())]
+    return '\n'.join(lines)
+
+
+def instrument(engine):
+    """Times every statement run through engine (a sync Engine, or an AsyncEngine's sync_engine)."""
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+
+
+def init_app(app, engine):
+    instrument(engine)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
@@ -0,0 +1,48 @@
+"""
+Applies the SQL files in migrations/ in filename order.
+
+Each file runs in its own transaction and is recorded in schema_migrations,
+so running the command again only applies new files:
+
+    flask --app server migrate
+"""
+import os
+
+from sqlalchemy import text
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+
+def pending_migrations(applied):
+    return [name for name in sorted(os.listdir(MIGRATIONS_DIR))
+            if name.endswith('.sql') and name not in applied]
+
+
+def apply_migrations(engine, echo=print):
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version text PRIMARY KEY,
+                applied_at timestamptz NOT NULL DEFAULT now()
+            )
+        """))
+        applied = {row.version for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+    names = pending_migrations(applied)
+    for name in names:
+        with open(os.path.join(MIGRATIONS_DIR, name)) as f:
+            sql = f.read()
+        with engine.begin() as conn:
+            # Sent to the driver as-is (no parameter parsing), so a file may hold several
+            # statements, and never prepared: Postgres prepares one command at a time
+            driver_conn = conn.connection.driver_connection
+            prepare_threshold, driver_conn.prepare_threshold = driver_conn.prepare_threshold, None
+            try:
+                conn.exec_driver_sql(sql, execution_options={'no_parameters': True})
+            finally:
+                driver_conn.prepare_threshold = prepare_threshold
+            conn.execute(text("INSERT INTO schema_migrations (version) VALUES (:v)"), {'v': name})
+        echo(f"applied {name}")
+    if not names:
+        echo("database is up to date")
+    return names
@@ -0,0 +1,9 @@
+-- Keyset pagination and search for /recipes and /api/recipes/search.
+
+-- Seek index for ORDER BY recipe_name, recipe_id with (recipe_name, recipe_id) > (:name, :id)
+CREATE INDEX IF NOT EXISTS recipe_name_id_idx ON recipe (recipe_name, recipe_id);
+
+-- Trigram indexes so ILIKE '%term%' on name and source can use an index scan
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS recipe_name_trgm_idx ON recipe USING gin (recipe_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS recipe_source_trgm_idx ON recipe USING gin (source gin_trgm_ops);
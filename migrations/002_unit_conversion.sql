@@ -0,0 +1,47 @@
+-- Unit conversion for the consolidated shopping list (/shopping).
+-- Each unit maps to a base unit of its dimension; a quantity converts from
+-- unit a to unit b when both share a base unit: quantity * a.factor / b.factor.
+-- Units are matched on lower(trim(unit)).
+
+CREATE TABLE IF NOT EXISTS unit_conversion (
+    unit text PRIMARY KEY,
+    base_unit text NOT NULL,
+    factor numeric NOT NULL CHECK (factor > 0)
+);
+
+INSERT INTO unit_conversion (unit, base_unit, factor) VALUES
+    -- mass, in grams
+    ('mg', 'g', 0.001),
+    ('g', 'g', 1),
+    ('gram', 'g', 1),
+    ('grams', 'g', 1),
+    ('kg', 'g', 1000),
+    ('kilogram', 'g', 1000),
+    ('kilograms', 'g', 1000),
+    ('oz', 'g', 28.349523125),
+    ('ounce', 'g', 28.349523125),
+    ('ounces', 'g', 28.349523125),
+    ('lb', 'g', 453.59237),
+    ('lbs', 'g', 453.59237),
+    ('pound', 'g', 453.59237),
+    ('pounds', 'g', 453.59237),
+    -- volume, in millilitres (US customary spoons and cups)
+    ('ml', 'ml', 1),
+    ('milliliter', 'ml', 1),
+    ('milliliters', 'ml', 1),
+    ('l', 'ml', 1000),
+    ('liter', 'ml', 1000),
+    ('liters', 'ml', 1000),
+    ('tsp', 'ml', 4.92892159375),
+    ('teaspoon', 'ml', 4.92892159375),
+    ('teaspoons', 'ml', 4.92892159375),
+    ('tbsp', 'ml', 14.78676478125),
+    ('tablespoon', 'ml', 14.78676478125),
+    ('tablespoons', 'ml', 14.78676478125),
+    ('fl oz', 'ml', 29.5735295625),
+    ('cup', 'ml', 236.5882365),
+    ('cups', 'ml', 236.5882365),
+    ('pint', 'ml', 473.176473),
+    ('quart', 'ml', 946.352946),
+    ('gallon', 'ml', 3785.411784)
+ON CONFLICT (unit) DO NOTHING;
@@ -0,0 +1,59 @@
+-- One DELETE FROM meal_plans removes a plan with its recipe links and grocery list,
+-- and ON CONFLICT (plan_id, recipe_id) works for idempotent recipe adds (meal_plans.py).
+
+DO $$
+DECLARE
+    link record;
+    fk record;
+    found boolean;
+BEGIN
+    FOR link IN
+        SELECT * FROM (VALUES
+            ('meal_plan_selects_recipe', 'plan_id', 'meal_plans', 'plan_id'),
+            ('grocery_list', 'plan_id', 'meal_plans', 'plan_id'),
+            ('grocery_list_contains_ingredients', 'grocery_id', 'grocery_list', 'grocery_id')
+        ) AS v (child, child_col, parent, parent_col)
+    LOOP
+        found := false;
+        -- Recreate existing foreign keys with ON DELETE CASCADE, keeping their other options
+        FOR fk IN
+            SELECT c.conname, c.confdeltype, pg_get_constraintdef(c.oid) AS def
+            FROM pg_constraint c
+            WHERE c.contype = 'f'
+              AND c.conrelid = link.child::regclass
+              AND c.confrelid = link.parent::regclass
+        LOOP
+            found := true;
+            CONTINUE WHEN fk.confdeltype = 'c';
+            EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', link.child, fk.conname);
+            EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I %s', link.child, fk.conname,
+                regexp_replace(
+                    regexp_replace(fk.def, ' ON DELETE (NO ACTION|RESTRICT|SET NULL|SET DEFAULT)( \([^)]*\))?', ''),
+                    -- The action goes after MATCH FULL/PARTIAL, which follows the referenced columns
+                    '(REFERENCES [^)]*\)( MATCH (FULL|PARTIAL|SIMPLE))?)', '\1 ON DELETE CASCADE'));
+        END LOOP;
+
+        -- No foreign key at all: add one. NOT VALID skips checking existing rows,
+        -- but the cascade still applies to every delete from now on.
+        IF NOT found THEN
+            EXECUTE format('ALTER TABLE %I ADD FOREIGN KEY (%I) REFERENCES %I (%I) ON DELETE CASCADE NOT VALID',
+                           link.child, link.child_col, link.parent, link.parent_col);
+        END IF;
+    END LOOP;
+
+    -- ON CONFLICT (plan_id, recipe_id) needs a unique index on exactly those columns
+    SELECT EXISTS (
+        SELECT 1
+        FROM pg_index i
+        WHERE i.indrelid = 'meal_plan_selects_recipe'::regclass
+          AND i.indisunique
+          AND i.indnkeyatts = 2
+          AND (SELECT array_agg(a.attname::text ORDER BY a.attname)
+               FROM pg_attribute a
+               WHERE a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)) = ARRAY['plan_id', 'recipe_id']
+    ) INTO found;
+    IF NOT found THEN
+        CREATE UNIQUE INDEX meal_plan_selects_recipe_plan_recipe_key
+            ON meal_plan_selects_recipe (plan_id, recipe_id);
+    END IF;
+END $$;
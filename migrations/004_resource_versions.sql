@@ -0,0 +1,39 @@
+-- Version counters behind the ETag / Last-Modified headers (versioning.py).
+-- 'recipes' and 'households' are bumped by these triggers on every write;
+-- 'household:<id>' (inventory and meal plans) is bumped by the app's write paths.
+
+CREATE TABLE IF NOT EXISTS resource_versions (
+    resource text PRIMARY KEY,
+    version bigint NOT NULL,
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+INSERT INTO resource_versions (resource, version)
+VALUES ('recipes', 1), ('households', 1)
+ON CONFLICT (resource) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_resource_version() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO resource_versions (resource, version, updated_at)
+    VALUES (TG_ARGV[0], 1, now())
+    ON CONFLICT (resource)
+    DO UPDATE SET version = resource_versions.version + 1, updated_at = now();
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS recipe_version ON recipe;
+CREATE TRIGGER recipe_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON recipe
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_resource_version('recipes');
+
+DROP TRIGGER IF EXISTS recipe_ingredient_version ON recipe_made_with_ingredient;
+CREATE TRIGGER recipe_ingredient_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON recipe_made_with_ingredient
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_resource_version('recipes');
+
+DROP TRIGGER IF EXISTS ingredient_version ON ingredient;
+CREATE TRIGGER ingredient_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON ingredient
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_resource_version('recipes');
+
+DROP TRIGGER IF EXISTS household_version ON household;
+CREATE TRIGGER household_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON household
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_resource_version('households');
@@ -0,0 +1,161 @@
+-- Per-household totals behind /api/households/<id>/stats (rollups.py), kept
+-- current by statement triggers on the meal plan tables so the stats never
+-- scan meal_plan_selects_recipe or grocery_list_contains_ingredients.
+--
+-- Child rows are credited to their plan's household. When a plan is deleted
+-- its BEFORE DELETE trigger subtracts everything the plan contributed; the
+-- cascaded child deletes that follow no longer find the plan and change
+-- nothing. TRUNCATE and moving a plan to another household are not tracked:
+-- run rebuild_household_rollups() (flask --app server rebuild-rollups) after those.
+
+CREATE TABLE IF NOT EXISTS household_recipe_rollup (
+    household_id integer NOT NULL,
+    recipe_id integer NOT NULL,
+    plans integer NOT NULL,
+    PRIMARY KEY (household_id, recipe_id)
+);
+
+CREATE INDEX IF NOT EXISTS household_recipe_rollup_top
+    ON household_recipe_rollup (household_id, plans DESC, recipe_id);
+
+CREATE TABLE IF NOT EXISTS household_grocery_rollup (
+    household_id integer NOT NULL,
+    ingredient_id integer NOT NULL,
+    unit text NOT NULL,
+    quantity numeric NOT NULL,
+    lines integer NOT NULL,
+    PRIMARY KEY (household_id, ingredient_id, unit)
+);
+
+-- sign is 1 for added rows and -1 for removed ones; rows that reach zero are dropped
+CREATE OR REPLACE FUNCTION rollup_recipe_changes(sign integer, plan_ids integer[], recipe_ids integer[])
+RETURNS void AS $$
+    INSERT INTO household_recipe_rollup AS r (household_id, recipe_id, plans)
+    SELECT mp.household_id, c.recipe_id, sign * count(*)
+    FROM unnest(plan_ids, recipe_ids) AS c (plan_id, recipe_id)
+    JOIN meal_plans mp ON mp.plan_id = c.plan_id
+    GROUP BY mp.household_id, c.recipe_id
+    ON CONFLICT (household_id, recipe_id)
+    DO UPDATE SET plans = r.plans + excluded.plans;
+
+    DELETE FROM household_recipe_rollup r
+    USING unnest(plan_ids, recipe_ids) AS c (plan_id, recipe_id)
+    JOIN meal_plans mp ON mp.plan_id = c.plan_id
+    WHERE r.household_id = mp.household_id AND r.recipe_id = c.recipe_id AND r.plans <= 0;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION rollup_grocery_changes(sign integer, grocery_ids integer[], ingredient_ids integer[],
+                                                  units text[], quantities numeric[])
+RETURNS void AS $$
+    INSERT INTO household_grocery_rollup AS r (household_id, ingredient_id, unit, quantity, lines)
+    SELECT mp.household_id, c.ingredient_id, coalesce(c.unit, ''),
+           sign * coalesce(sum(c.quantity), 0), sign * count(*)
+    FROM unnest(grocery_ids, ingredient_ids, units, quantities) AS c (grocery_id, ingredient_id, unit, quantity)
+    JOIN grocery_list gl ON gl.grocery_id = c.grocery_id
+    JOIN meal_plans mp ON mp.plan_id = gl.plan_id
+    GROUP BY mp.household_id, c.ingredient_id, coalesce(c.unit, '')
+    ON CONFLICT (household_id, ingredient_id, unit)
+    DO UPDATE SET quantity = r.quantity + excluded.quantity, lines = r.lines + excluded.lines;
+
+    DELETE FROM household_grocery_rollup r
+    USING unnest(grocery_ids, ingredient_ids, units) AS c (grocery_id, ingredient_id, unit)
+    JOIN grocery_list gl ON gl.grocery_id = c.grocery_id
+    JOIN meal_plans mp ON mp.plan_id = gl.plan_id
+    WHERE r.household_id = mp.household_id AND r.ingredient_id = c.ingredient_id
+      AND r.unit = coalesce(c.unit, '') AND r.lines <= 0;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION rollup_plan_recipes() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM rollup_recipe_changes(-1, array_agg(plan_id), array_agg(recipe_id)) FROM old_rows;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'INSERT') THEN
+        PERFORM rollup_recipe_changes(1, array_agg(plan_id), array_agg(recipe_id)) FROM new_rows;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rollup_grocery_lines() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM rollup_grocery_changes(-1, array_agg(grocery_id), array_agg(ingredient_id),
+                                       array_agg(unit), array_agg(quantity)) FROM old_rows;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'INSERT') THEN
+        PERFORM rollup_grocery_changes(1, array_agg(grocery_id), array_agg(ingredient_id),
+                                       array_agg(unit), array_agg(quantity)) FROM new_rows;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rollup_plan_delete() RETURNS trigger AS $$
+BEGIN
+    PERFORM rollup_recipe_changes(-1, array_agg(plan_id), array_agg(recipe_id))
+    FROM meal_plan_selects_recipe
+    WHERE plan_id = OLD.plan_id;
+    PERFORM rollup_grocery_changes(-1, array_agg(gi.grocery_id), array_agg(gi.ingredient_id),
+                                   array_agg(gi.unit), array_agg(gi.quantity))
+    FROM grocery_list gl
+    JOIN grocery_list_contains_ingredients gi ON gi.grocery_id = gl.grocery_id
+    WHERE gl.plan_id = OLD.plan_id;
+    RETURN OLD;
+END
+$$ LANGUAGE plpgsql;
+
+-- Transition tables need one trigger per event
+DROP TRIGGER IF EXISTS plan_recipes_rollup_insert ON meal_plan_selects_recipe;
+CREATE TRIGGER plan_recipes_rollup_insert AFTER INSERT ON meal_plan_selects_recipe
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_plan_recipes();
+
+DROP TRIGGER IF EXISTS plan_recipes_rollup_update ON meal_plan_selects_recipe;
+CREATE TRIGGER plan_recipes_rollup_update AFTER UPDATE ON meal_plan_selects_recipe
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_plan_recipes();
+
+DROP TRIGGER IF EXISTS plan_recipes_rollup_delete ON meal_plan_selects_recipe;
+CREATE TRIGGER plan_recipes_rollup_delete AFTER DELETE ON meal_plan_selects_recipe
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_plan_recipes();
+
+DROP TRIGGER IF EXISTS grocery_lines_rollup_insert ON grocery_list_contains_ingredients;
+CREATE TRIGGER grocery_lines_rollup_insert AFTER INSERT ON grocery_list_contains_ingredients
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_grocery_lines();
+
+DROP TRIGGER IF EXISTS grocery_lines_rollup_update ON grocery_list_contains_ingredients;
+CREATE TRIGGER grocery_lines_rollup_update AFTER UPDATE ON grocery_list_contains_ingredients
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_grocery_lines();
+
+DROP TRIGGER IF EXISTS grocery_lines_rollup_delete ON grocery_list_contains_ingredients;
+CREATE TRIGGER grocery_lines_rollup_delete AFTER DELETE ON grocery_list_contains_ingredients
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_grocery_lines();
+
+DROP TRIGGER IF EXISTS meal_plan_rollup_delete ON meal_plans;
+CREATE TRIGGER meal_plan_rollup_delete BEFORE DELETE ON meal_plans
+    FOR EACH ROW EXECUTE FUNCTION rollup_plan_delete();
+
+-- Recomputes both rollups from the meal plan tables
+CREATE OR REPLACE FUNCTION rebuild_household_rollups() RETURNS void AS $$
+    TRUNCATE household_recipe_rollup, household_grocery_rollup;
+
+    INSERT INTO household_recipe_rollup (household_id, recipe_id, plans)
+    SELECT mp.household_id, mpsr.recipe_id, count(*)
+    FROM meal_plan_selects_recipe mpsr
+    JOIN meal_plans mp ON mp.plan_id = mpsr.plan_id
+    GROUP BY mp.household_id, mpsr.recipe_id;
+
+    INSERT INTO household_grocery_rollup (household_id, ingredient_id, unit, quantity, lines)
+    SELECT mp.household_id, gi.ingredient_id, coalesce(gi.unit, ''), coalesce(sum(gi.quantity), 0), count(*)
+    FROM grocery_list_contains_ingredients gi
+    JOIN grocery_list gl ON gl.grocery_id = gi.grocery_id
+    JOIN meal_plans mp ON mp.plan_id = gl.plan_id
+    GROUP BY mp.household_id, gi.ingredient_id, coalesce(gi.unit, '');
+$$ LANGUAGE sql;
+
+SELECT rebuild_household_rollups();
@@ -0,0 +1,19 @@
+-- The 'recipes' and 'households' version triggers from 004 also tell every
+-- app process to drop what it cached from those tables (the recipe x
+-- ingredient matrix, the household and ingredient lists, the version table),
+-- including after writes made outside the app. The notification goes out on
+-- commit on the reference cache's channel (REFCACHE_CHANNEL in the app):
+-- 'refcache' unless the database sets another one with
+--
+--     ALTER DATABASE ... SET app.refcache_channel = '...';
+
+CREATE OR REPLACE FUNCTION bump_resource_version() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO resource_versions (resource, version, updated_at)
+    VALUES (TG_ARGV[0], 1, now())
+    ON CONFLICT (resource)
+    DO UPDATE SET version = resource_versions.version + 1, updated_at = now();
+    PERFORM pg_notify(COALESCE(NULLIF(current_setting('app.refcache_channel', true), ''), 'refcache'), TG_ARGV[0]);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
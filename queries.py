@@ -0,0 +1,161 @@
+"""
+The statements server.py runs directly, built once at import: the page loads
+(and the caches behind them) and the inventory and household writes.
+
+The set-based writes and reports in meal_plans.py, cooking.py, shopping.py,
+rollups.py and versioning.bump() keep their SQL in their own modules as
+text(); where a parameter's type matters they CAST it in the SQL instead
+(CAST(:rids AS integer[])).
+
+These are module constants with typed bind parameters. The psycopg 3 driver
+renders typed parameters with explicit casts (%(hid)s::INTEGER), so each
+statement has one stable server-side signature whatever Python value is
+bound (an inline text() sends whatever type psycopg picks for the value).
+Both engines (db.py and aio.py) prepare a statement on each connection once it
+has run DATABASE_PREPARE_THRESHOLD times (see db.prepare_threshold_from_env),
+and Postgres then skips parsing and planning it.
+
+    rows = await adb.fetch(queries.HOUSEHOLD_PLANS, {'hid': hid})
+
+bench/prepared.py measures what this saves on the /cookable and /mealplans queries.
+"""
+import functools
+
+from sqlalchemy import Integer, Numeric, String, bindparam, text
+from sqlalchemy.dialects.postgresql import ARRAY
+
+
+def _statement(sql, **types):
+    """A text() statement with typed bind parameters."""
+    return text(sql).bindparams(*(bindparam(name, type_=type_) for name, type_ in types.items()))
+
+
+#
+# Reference lists (refcache.py) and resource versions (versioning.py)
+#
+HOUSEHOLDS = _statement("SELECT household_id, household_name FROM household ORDER BY household_name")
+
+INGREDIENTS = _statement("SELECT ingredient_id, ingredient_name, unit FROM ingredient ORDER BY ingredient_name")
+
+RESOURCE_VERSIONS = _statement("SELECT resource, version, updated_at FROM resource_versions")
+
+#
+# /inventory
+#
+INVENTORY_ITEMS = _statement("""
+    SELECT i.ingredient_name, hi.quantity, hi.unit
+    FROM household_in_inventory_ingredient hi
+    JOIN ingredient i ON i.ingredient_id = hi.ingredient_id
+    WHERE hi.household_id = :hid
+    ORDER BY i.ingredient_name
+""", hid=Integer)
+
+#
+# /cookable and similar recipes: the recipe x ingredient matrix
+# (recipe_matrix.py), loaded once per RECIPE_MATRIX_TTL, and one household's
+# inventory (cookable_index.py), loaded once per household
+#
+COOKABLE_RECIPES = _statement("""
+    SELECT recipe_id, recipe_name, portion_size
+    FROM recipe
+    ORDER BY recipe_name
+""")
+
+COOKABLE_REQUIREMENTS = _statement("""
+    SELECT ri.recipe_id, ri.ingredient_id, ri.quantity, ri.unit,
+           i.ingredient_name, i.unit AS ingredient_unit
+    FROM recipe_made_with_ingredient ri
+    JOIN ingredient i ON i.ingredient_id = ri.ingredient_id
+""")
+
+HOUSEHOLD_INVENTORY = _statement("""
+    SELECT ingredient_id, quantity
+    FROM household_in_inventory_ingredient
+    WHERE household_id = :hid
+""", hid=Integer)
+
+#
+# /mealplans: a household's plans, their recipes and their grocery lines
+#
+HOUSEHOLD_PLANS = _statement("""
+    SELECT mp.plan_id, mp.label
+    FROM meal_plans mp
+    WHERE mp.household_id = :hid
+    ORDER BY mp.label
+""", hid=Integer)
+
+HOUSEHOLD_PLAN_RECIPES = _statement("""
+    SELECT mpsr.plan_id, r.recipe_name
+    FROM meal_plans mp
+    JOIN meal_plan_selects_recipe mpsr ON mpsr.plan_id = mp.plan_id
+    JOIN recipe r ON r.recipe_id = mpsr.recipe_id
+    WHERE mp.household_id = :hid
+    ORDER BY mpsr.plan_id, r.recipe_name
+""", hid=Integer)
+
+HOUSEHOLD_GROCERY_LINES = _statement("""
+    SELECT gl.plan_id, i.ingredient_name, gci.quantity, gci.unit
+    FROM meal_plans mp
+    JOIN grocery_list gl ON gl.plan_id = mp.plan_id
+    JOIN grocery_list_contains_ingredients gci ON gci.grocery_id = gl.grocery_id
+    JOIN ingredient i ON i.ingredient_id = gci.ingredient_id
+    WHERE mp.household_id = :hid
+    ORDER BY gl.plan_id, i.ingredient_name
+""", hid=Integer)
+
+#
+# /inventory and /households writes
+#
+INVENTORY_ADD = _statement("""
+    INSERT INTO household_in_inventory_ingredient (household_id, ingredient_id, quantity, unit)
+    VALUES (:hid, :iid, :qty, (SELECT unit FROM ingredient WHERE ingredient_id = :iid))
+    ON CONFLICT (household_id, ingredient_id)
+    DO UPDATE SET quantity = household_in_inventory_ingredient.quantity + EXCLUDED.quantity,
+                  unit = EXCLUDED.unit
+""", hid=Integer, iid=Integer, qty=Numeric)
+
+HOUSEHOLD_INSERT = _statement("INSERT INTO household (household_name) VALUES (:name)", name=String)
+
+HOUSEHOLD_DELETE = _statement("DELETE FROM household WHERE household_id = :hid", hid=Integer)
+
+#
+# /recipes, /shopping and /api/recipes/search
+#
+@functools.lru_cache(maxsize=None)
+def recipe_page(search, after):
+    """
+    One /recipes page: search filters on :pattern, after continues from
+    (:after_name, :after_id). Four variants, each built on first use.
+    """
+    conditions = []
+    types = {'limit': Integer}
+    if search:
+        conditions.append("(recipe_name ILIKE :pattern OR source ILIKE :pattern)")
+        types['pattern'] = String
+    if after:
+        conditions.append("(recipe_name, recipe_id) > (:after_name, :after_id)")
+        types.update(after_name=String, after_id=Integer)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return _statement(f"""
+        SELECT recipe_id, recipe_name, portion_size, source
+        FROM recipe
+        {where}
+        ORDER BY recipe_name, recipe_id
+        LIMIT :limit
+    """, **types)
+
+
+SHOPPING_PLANS = _statement("""
+    SELECT plan_id, label
+    FROM meal_plans
+    WHERE household_id = :hid AND plan_id = ANY(:pids)
+    ORDER BY label
+""", hid=Integer, pids=ARRAY(Integer))
+
+RECIPE_SEARCH = _statement("""
+    SELECT recipe_id, recipe_name
+    FROM recipe
+    WHERE recipe_name ILIKE :pattern
+    ORDER BY recipe_name ILIKE :prefix DESC, recipe_name, recipe_id
+    LIMIT :limit
+""", pattern=String, prefix=String, limit=Integer)
@@ -0,0 +1,116 @@
+"""
+The recipe x ingredient matrix behind cookable_index.py and similarity.py.
+
+recipe_made_with_ingredient is loaded once (queries.COOKABLE_RECIPES and
+queries.COOKABLE_REQUIREMENTS) into NumPy arrays, rows in recipe-name order:
+
+- CSR by recipe: row pointers (indptr), ingredient columns (cols), and per
+  requirement the quantity (qty) and whether it is in the ingredient's own
+  unit, the unit inventory is stored in (comparable)
+- CSC by ingredient: the recipes using each ingredient (col_indptr, col_rows)
+- each recipe's ingredients as a bitset (masks, a Python int with one bit per column)
+
+A RecipeMatrix never changes once built. RecipeMatrices.get() returns the
+current one and loads a new one once the 'recipes' resource version moves
+past the one it was loaded at (see versioning.py), after invalidate() (the
+reference cache's 'recipes' invalidation, see server.py) or after
+RECIPE_MATRIX_TTL seconds (default 300). Results derived from a matrix are
+memoized in its memo dict.
+"""
+import os
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import queries
+
+Recipe = namedtuple('Recipe', ['recipe_id', 'recipe_name', 'portion_size'])
+
+
+def _same_unit(a, b):
+    return (a or '').strip().lower() == (b or '').strip().lower()
+
+
+class RecipeMatrix:
+
+    def __init__(self, recipes, requirements, version=0):
+        self.version = version
+        self.recipes = [Recipe(r.recipe_id, r.recipe_name, r.portion_size) for r in recipes]
+        self.row_of = {r.recipe_id: i for i, r in enumerate(self.recipes)}
+        requirements = sorted((row for row in requirements if row.recipe_id in self.row_of),
+                              key=lambda row: self.row_of[row.recipe_id])
+
+        self.col_of = {}            # ingredient_id -> column
+        self.ingredient_ids = []    # column -> ingredient_id
+        self.ingredient_names = []  # column -> ingredient name
+        cols, qty, comparable = [], [], []
+        for row in requirements:
+            col = self.col_of.get(row.ingredient_id)
+            if col is None:
+                col = self.col_of[row.ingredient_id] = len(self.ingredient_ids)
+                self.ingredient_ids.append(row.ingredient_id)
+                self.ingredient_names.append(row.ingredient_name)
+            cols.append(col)
+            qty.append(float(row.quantity) if row.quantity is not None else 0.0)
+            comparable.append(_same_unit(row.unit, row.ingredient_unit))
+
+        n_rows, n_cols = len(self.recipes), len(self.ingredient_ids)
+        self.rows = np.fromiter((self.row_of[row.recipe_id] for row in requirements), dtype=np.int64,
+                                count=len(requirements))
+        self.cols = np.array(cols, dtype=np.int64)
+        self.qty = np.array(qty, dtype=np.float64)
+        self.comparable = np.array(comparable, dtype=bool)
+        self.sizes = np.bincount(self.rows, minlength=n_rows)
+        self.indptr = np.concatenate(([0], np.cumsum(self.sizes)))
+
+        self.col_rows = self.rows[np.argsort(self.cols, kind='stable')]
+        self.freq = np.bincount(self.cols, minlength=n_cols)
+        self.col_indptr = np.concatenate(([0], np.cumsum(self.freq)))
+
+        self.masks = [0] * n_rows
+        for row, col in zip(self.rows.tolist(), cols):
+            self.masks[row] |= 1 << col
+
+        self.loaded_at = time.monotonic()
+        self.memo = {}
+
+    def recipes_using(self, col):
+        return self.col_rows[self.col_indptr[col]:self.col_indptr[col + 1]]
+
+    def mask(self, ingredient_ids):
+        """Bitset of the given ingredients (ones no recipe uses are left out)."""
+        mask = 0
+        for ingredient_id in ingredient_ids:
+            col = self.col_of.get(ingredient_id)
+            if col is not None:
+                mask |= 1 << col
+        return mask
+
+
+class RecipeMatrices:
+
+    def __init__(self, version=None, ttl=None):
+        """version() returns the current 'recipes' resource version."""
+        self.version = version
+        self.ttl = ttl if ttl is not None else float(os.getenv("RECIPE_MATRIX_TTL", "300"))
+        self._lock = threading.Lock()
+        self._matrix = None
+
+    def get(self, conn):
+        """The current RecipeMatrix, loaded on conn if there is none or it is out of date."""
+        # Read before loading, so the matrix is at least as new as its version
+        version = self.version() if self.version else 0
+        with self._lock:
+            matrix = self._matrix
+            if matrix is None or matrix.version < version or time.monotonic() - matrix.loaded_at > self.ttl:
+                matrix = self._matrix = RecipeMatrix(conn.execute(queries.COOKABLE_RECIPES).fetchall(),
+                                                     conn.execute(queries.COOKABLE_REQUIREMENTS).fetchall(),
+                                                     version)
+            return matrix
+
+    def invalidate(self):
+        """Drops the matrix, e.g. after recipes or their ingredients change."""
+        with self._lock:
+            self._matrix = None
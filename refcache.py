@@ -0,0 +1,156 @@
+"""
+Read-through cache for small reference data sets (households, ingredients).
+
+Entries live for REFCACHE_TTL seconds (default 60) and are dropped early by
+the write paths calling invalidate(). When REFCACHE_CHANNEL is set, writers
+also publish the invalidated keys with pg_notify and every process runs a
+listener thread on that channel, so all workers drop their copies together.
+Anything else that changes these tables can do the same with:
+
+    NOTIFY refcache, 'ingredients';
+
+A lookup can pass the version of the data it needs (a resource_versions
+counter, see versioning.py): an entry loaded at an older version is a miss, so
+a worker that has not heard about a write yet still reloads once the version
+moves.
+
+Keys can also name one item of a kind, e.g. 'household:5'; on_invalidate
+('household:', ...) hears about every household.
+
+The listener holds its own connection, opened outside the engine's pool, so
+it does not take one of DATABASE_POOL_SIZE's slots for the life of the process.
+"""
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+import psycopg
+from sqlalchemy import text
+
+log = logging.getLogger(__name__)
+
+
+class ReferenceCache:
+
+    def __init__(self, ttl=None, channel=None):
+        self.ttl = ttl if ttl is not None else float(os.getenv("REFCACHE_TTL", "60"))
+        self.channel = channel if channel is not None else os.getenv("REFCACHE_CHANNEL") or None
+        self._lock = threading.Lock()
+        self._entries = {}          # key -> (value, expires at, version loaded at)
+        self._callbacks = {}        # key -> [called on invalidate]
+        self.hits = Counter()
+        self.misses = Counter()
+        self.invalidations = Counter()
+        self._engine = None
+        self._listener_pid = None
+
+    def get(self, key, load, ttl=None, version=0):
+        """
+        Returns the cached value for key, calling load() to fill it on a miss.
+        ttl overrides REFCACHE_TTL for this key. version, read before calling
+        get(), makes an entry loaded at an older version a miss.
+        """
+        hit, value, now = self._lookup(key, version)
+        if hit:
+            return value
+        value = load()
+        self._store(key, value, now, ttl, version)
+        return value
+
+    async def get_async(self, key, load, ttl=None, version=0):
+        """get() for the async read path (aio.py): load is a coroutine function."""
+        hit, value, now = self._lookup(key, version)
+        if hit:
+            return value
+        value = await load()
+        self._store(key, value, now, ttl, version)
+        return value
+
+    def _lookup(self, key, version):
+        self._ensure_listener()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now and entry[2] >= version:
+                self.hits[key] += 1
+                return True, entry[0], now
+            self.misses[key] += 1
+        return False, None, now
+
+    def _store(self, key, value, loaded_at, ttl, version):
+        with self._lock:
+            self._entries[key] = (value, loaded_at + (self.ttl if ttl is None else ttl), version)
+
+    def invalidate(self, *keys):
+        calls = []
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+                kind, sep, item = key.partition(':')
+                if sep and kind + sep in self._callbacks:
+                    # Counted per kind, not per item
+                    self.invalidations[kind + sep] += 1
+                    calls.extend((cb, (item,)) for cb in self._callbacks[kind + sep])
+                else:
+                    self.invalidations[key] += 1
+                    calls.extend((cb, ()) for cb in self._callbacks.get(key, []))
+        for callback, args in calls:
+            callback(*args)
+
+    def on_invalidate(self, key, callback):
+        """
+        Runs callback() whenever key is invalidated, locally or by NOTIFY. A key
+        ending in ':' matches every item of that kind, and callback gets the
+        item: on_invalidate('household:', f) calls f('5') for 'household:5'.
+        """
+        self._callbacks.setdefault(key, []).append(callback)
+
+    def publish(self, conn, *keys):
+        """
+        Queues a NOTIFY for each key on conn's transaction, so other processes
+        invalidate once it commits. Does nothing unless REFCACHE_CHANNEL is set.
+        """
+        if not self.channel:
+            return
+        for key in keys:
+            conn.execute(text("SELECT pg_notify(:channel, :key)"), {'channel': self.channel, 'key': key})
+
+    def stats(self):
+        with self._lock:
+            keys = sorted(set(self.hits) | set(self.misses) | set(self.invalidations))
+            return {key: {'hits': self.hits[key], 'misses': self.misses[key],
+                          'invalidations': self.invalidations[key]} for key in keys}
+
+    def listen(self, engine):
+        """Remembers the engine whose database to LISTEN on; the thread starts on first use in each process."""
+        self._engine = engine
+
+    def _ensure_listener(self):
+        if not self.channel or self._engine is None or self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+        threading.Thread(target=self._listen_forever, name="refcache-listener", daemon=True).start()
+
+    def _listen_forever(self):
+        conninfo = self._engine.url.set(drivername='postgresql').render_as_string(hide_password=False)
+        while True:
+            try:
+                with psycopg.connect(conninfo, autocommit=True) as conn:
+                    conn.execute(f'LISTEN "{self.channel}"')
+                    # Anything cached before LISTEN took effect may have missed a notification
+                    self._clear()
+                    for notify in conn.notifies():
+                        self.invalidate(notify.payload)
+            except Exception:
+                log.exception("reference cache listener on %r failed; reconnecting in 5 s", self.channel)
+                time.sleep(5)
+
+    def _clear(self):
+        with self._lock:
+            keys = list(self._entries)
+        self.invalidate(*keys)
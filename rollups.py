@@ -0,0 +1,38 @@
+"""
+Household usage stats from the rollup tables in migrations/005_household_rollups.sql.
+
+household_recipe_rollup counts the plans each recipe is in per household and
+household_grocery_rollup totals each household's grocery lines per ingredient
+and unit. Triggers on the meal plan tables keep both current, so every query
+here reads only the rows it returns. rebuild() recomputes them from scratch:
+
+    flask --app server rebuild-rollups
+"""
+from sqlalchemy import text
+
+
+def rebuild(conn):
+    conn.execute(text("SELECT rebuild_household_rollups()"))
+
+
+def top_recipes(conn, household_id, limit=10):
+    """The household's most planned recipes: [(recipe_id, recipe_name, plans)]."""
+    return conn.execute(text("""
+        SELECT r.recipe_id, r.recipe_name, hr.plans
+        FROM household_recipe_rollup hr
+        JOIN recipe r ON r.recipe_id = hr.recipe_id
+        WHERE hr.household_id = :hid
+        ORDER BY hr.plans DESC, hr.recipe_id
+        LIMIT :limit
+    """), {'hid': household_id, 'limit': limit}).fetchall()
+
+
+def grocery_totals(conn, household_id):
+    """Grocery quantity per ingredient and unit across all of the household's plans, by ingredient name."""
+    return conn.execute(text("""
+        SELECT i.ingredient_id, i.ingredient_name, hg.unit, hg.quantity, hg.lines
+        FROM household_grocery_rollup hg
+        JOIN ingredient i ON i.ingredient_id = hg.ingredient_id
+        WHERE hg.household_id = :hid
+        ORDER BY i.ingredient_name, hg.unit
+    """), {'hid': household_id}).fetchall()
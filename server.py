@@ -11,15 +11,39 @@ Read about it online.
 from dotenv import load_dotenv
 load_dotenv()
 
+import asyncio
+import hmac
+import io
+import json
 import os
 # accessible as a variable in index.html:
 from sqlalchemy import *
-from sqlalchemy.pool import NullPool
-from flask import Flask, request, render_template, g, redirect, Response, abort
+from sqlalchemy.exc import DBAPIError
+from flask import Flask, Blueprint, current_app, request, render_template, g, redirect, Response, abort, jsonify
+from markupsafe import escape
 from urllib.parse import quote_plus
 
+import aio
+import cooking
+import db
+import exports
+import fragments
+import inventory_import
+import metrics
+import meal_plans
+import migrate
+import queries
+import rollups
+import shopping
+import versioning
+from cookable_index import CookableIndex
+from recipe_matrix import RecipeMatrices
+from refcache import ReferenceCache
+from similarity import METRICS, RecipeSimilarity
+
 tmpl_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
-app = Flask(__name__, template_folder=tmpl_dir)
+# Routes are registered on a blueprint; create_app() builds the app (one per worker process)
+views = Blueprint('views', __name__, cli_group=None)
 
 DATABASE_USER = os.getenv("DATABASE_USER")
 DATABASE_PASS = quote_plus(os.getenv("DATABASE_PASS"))  # safely escape symbols
@@ -42,74 +66,243 @@ DATABASE_NAME = os.getenv("DATABASE_NAME")
 
 DATABASEURI = f"postgresql://{DATABASE_USER}:{DATABASE_PASS}@{DATABASE_HOST}/{DATABASE_NAME}"
 
+# Optional read replicas of the same database, same credentials (see db.py)
+REPLICA_URIS = [f"postgresql://{DATABASE_USER}:{DATABASE_PASS}@{host}/{DATABASE_NAME}"
+                for host in db.replica_hosts_from_env()]
+
 
 #
-# This line creates a database engine that knows how to connect to the URI above.
+# Recipe x ingredient matrix behind the cookable index and "similar recipes",
+# reloaded after the recipe catalog changes ('recipes' version, see versions below).
 #
-engine = create_engine(DATABASEURI)
+recipe_matrices = RecipeMatrices(lambda: versions.version('recipes'))
 
 #
-# Example of running queries in your database
-# Note that this will probably not work if you already have a table named 'test' in your database, containing meaningful data. This is only an example showing you how to run queries in your database using SQLAlchemy.
+# Per-household cookable recipes. The inventory and household write paths
+# invalidate 'household:<id>' in the reference cache below, which drops the
+# household's entry in every worker; entries also reload when the
+# household's version moves.
 #
-with engine.connect() as conn:
-	# create_table_command = """
-	# CREATE TABLE IF NOT EXISTS test (
-	# 	id serial,
-	# 	name text
-	# )
-	# """
-	# res = conn.execute(text(create_table_command))
-	# insert_table_command = """INSERT INTO test(name) VALUES ('grace hopper'), ('alan turing'), ('ada lovelace')"""
-	# res = conn.execute(text(insert_table_command))
-	# # you need to commit for create, insert, update queries to reflect
-	# conn.commit()
-	result = conn.execute(text("SELECT 1"))
-	print("Database connection OK:", result.fetchone())
-
-
-@app.before_request
-def before_request():
-	"""
-	This function is run at the beginning of every web request 
-	(every time you enter an address in the web browser).
-	We use it to setup a database connection that can be used throughout the request.
+cookable_recipes = CookableIndex(recipe_matrices, lambda hid: versions.version(f'household:{hid}'))
+recipe_similarity = RecipeSimilarity(recipe_matrices)
 
-	The variable g is globally accessible.
-	"""
-	try:
-		g.conn = engine.connect()
-	except:
-		print("uh oh, problem connecting to database")
-		import traceback; traceback.print_exc()
-		g.conn = None
-
-@app.teardown_request
+#
+# Household and ingredient lists shared by every page, invalidated by the write paths.
+# Set REFCACHE_CHANNEL to keep several worker processes in sync with LISTEN/NOTIFY.
+#
+ref_cache = ReferenceCache()
+ref_cache.on_invalidate('recipes', recipe_matrices.invalidate)
+ref_cache.on_invalidate('household:', cookable_recipes.drop_household)
+
+#
+# Resource versions behind the ETag / Last-Modified headers of read-only pages.
+# Write paths call versions.bump() before committing and versions.invalidate() after.
+#
+versions = versioning.ResourceVersions(ref_cache, lambda: load_versions(), shared=lambda: versions_shared())
+
+# How long browsers and proxies may reuse a recipe catalog page without revalidating
+RECIPES_MAX_AGE = int(os.getenv("RECIPES_MAX_AGE", "60"))
+
+#
+# Rendered plan cards and <select> option lists, reused while their data is unchanged.
+#
+fragment_cache = fragments.FragmentCache()
+
+
+def create_app():
+    """
+    Builds the Flask app. Nothing here touches the database: the engine only
+    connects when a request first needs a connection, so the app starts even
+    while the database is unreachable (/readyz reports it). Under gunicorn
+    each worker calls this after fork and gets its own engine and pool.
+    """
+    app = Flask(__name__, template_folder=tmpl_dir)
+    app.register_blueprint(views)
+
+    #
+    # This line creates a database engine that knows how to connect to the URI above.
+    # Pool size, overflow, recycle, pre-ping and checkout timeout come from the
+    # DATABASE_POOL_* variables in .env (see db.py).
+    #
+    engine = db.create_db_engine(DATABASEURI)
+    # GET requests read from these when DATABASE_REPLICA_HOSTS is set
+    replicas = [db.create_db_engine(uri) for uri in REPLICA_URIS]
+    db.init_app(app, engine, replicas)
+    # Statement counts and timings per request: Server-Timing header and /metrics
+    metrics.init_app(app, engine)
+    for replica in replicas:
+        metrics.instrument(replica)
+    ref_cache.listen(engine)
+    # Async engines for pages that run independent queries concurrently (see aio.py)
+    aio.init_app(app, DATABASEURI, REPLICA_URIS)
+    return app
+
+
+@views.teardown_app_request
 def teardown_request(exception):
 	"""
-	At the end of the web request, this makes sure to close the database connection.
-	If you don't, the database could run out of memory!
+	At the end of the web request, this returns the database connections to their pools.
+	g.conn is only checked out when a view first uses it (see db.LazyConnGlobals),
+	so requests that never touch the database never hold a connection.
 	"""
-	try:
-		g.conn.close()
-	except Exception as e:
-		pass
+	db.close_request_connections()
+
+
+@views.cli.command('migrate')
+def migrate_command():
+    """Applies pending SQL files from migrations/ (flask --app server migrate)."""
+    migrate.apply_migrations(db.get_engine())
+
+
+@views.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recomputes the household stats rollups from the meal plan tables (flask --app server rebuild-rollups)."""
+    with db.get_engine().begin() as conn:
+        rollups.rebuild(conn)
+    print("rebuilt household rollups")
+
+
+@views.route('/healthz')
+def healthz():
+    """Liveness: the worker is up and serving requests. Does not touch the database."""
+    return jsonify(status='ok')
+
+
+@views.route('/readyz')
+def readyz():
+    """Readiness: 503 until a database connection can be checked out and used."""
+    try:
+        with db.checkout() as conn:
+            conn.execute(text("SELECT 1"))
+    except Exception as e:
+        return jsonify(status='unavailable', error=str(e)), 503
+    return jsonify(status='ok')
+
+
+@views.route('/internal/stats')
+def internal_stats():
+    """Connection pool saturation, checkout wait times and cache hit rates as JSON."""
+    return jsonify(pool=db.pool_stats.snapshot(db.get_engine()), refcache=ref_cache.stats(),
+                   fragments=fragment_cache.stats())
+
+
+@views.route('/metrics')
+def prometheus_metrics():
+    """Request and SQL latency histograms plus pool and cache counters, in Prometheus format."""
+    pool = db.pool_stats.snapshot(db.get_engine())
+    cache = ref_cache.stats()
+    fragments = fragment_cache.stats()
+    extra = [
+        metrics.gauge('db_pool_checked_out', 'Connections currently checked out', pool['checked_out']),
+        metrics.gauge('db_pool_saturation', 'Checked out connections / (pool size + max overflow)', pool['saturation'] or 0),
+        metrics.gauge('db_pool_checkout_wait_max_seconds', 'Longest pool checkout wait', pool['checkout_wait_max_ms'] / 1000),
+        metrics.gauge('db_pool_checkout_timeouts', 'Pool checkouts that timed out', pool['checkout_timeouts']),
+        metrics.counter('refcache_hits_total', 'Reference cache hits', {k: v['hits'] for k, v in cache.items()}, 'key'),
+        metrics.counter('refcache_misses_total', 'Reference cache misses', {k: v['misses'] for k, v in cache.items()}, 'key'),
+        metrics.counter('fragment_cache_lookups_total', 'Rendered fragment cache lookups',
+                        {'hit': fragments['hits'], 'miss': fragments['misses']}, 'result'),
+        metrics.gauge('fragment_cache_bytes', 'Size of the cached fragments', fragments['bytes']),
+    ]
+    return Response(metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
+
+def load_versions():
+    # The cached copy is only loaded by requests on the primary (see
+    # versions_shared); a replica request reads the versions of its own data
+    conn = g.conn
+    try:
+        return conn.execute(queries.RESOURCE_VERSIONS).fetchall()
+    except DBAPIError:
+        # e.g. no resource_versions before migration 004: leave g.conn usable for the view
+        conn.rollback()
+        raise
+
+
+def versions_shared():
+    return db.read_replica() is None
+
+
+def household_list():
+    """All households by name, from the reference cache (reloaded when the 'households' version moves)."""
+    return ref_cache.get('households', lambda: db.primary().execute(queries.HOUSEHOLDS).fetchall(),
+                         version=versions.version('households'))
+
+
+def selected_household():
+    """hid from the query string, or the first household, which pages show by default."""
+    if request.args.get('hid'):
+        return request.args.get('hid')
+    households = household_list()
+    return households[0].household_id if households else None
+
+
+def household_page_resources():
+    """What /cookable and /mealplans are built from (see versioning.py)."""
+    return ['households', 'recipes', f'household:{selected_household()}']
+
+
+def household_options(households, sel_hid):
+    """The household <option>s, rendered once per household list and selection."""
+    return fragment_cache.render(('household-options', sel_hid), lambda: render_template(
+        '_household_options.html', households=households, sel_hid=sel_hid), source=households)
+
+
+def ingredient_options(ingredients):
+    """The ingredient <option>s for the inventory form, rendered once per ingredient list."""
+    return fragment_cache.render(('ingredient-options',), lambda: render_template(
+        '_ingredient_options.html', ingredients=ingredients), source=ingredients)
+
+
+def plan_card(plan, sel_hid, current):
+    """
+    One rendered plan card, reused until the plan or the recipe catalog changes.
+    current is versions.current(), read before the plan's data was.
+    """
+    key = ('plan-card', plan['plan_id'], versions.version(f"plan:{plan['plan_id']}", current),
+           versions.version('recipes', current), sel_hid)
+    return fragment_cache.render(key, lambda: render_template('_plan_card.html', plan=plan, sel_hid=sel_hid))
+
+
+async def households_async(adb, current):
+    """
+    household_list() for the async read path: a cache miss loads on its own
+    connection. current is versions.current(), read by the view (the loop
+    thread has no request context).
+    """
+    return await ref_cache.get_async('households', lambda: adb.primary.fetch(queries.HOUSEHOLDS),
+                                     version=versions.version('households', current))
+
+
+async def gather_for_household(adb, hid, load, current):
+    """
+    Returns (households, household id, await load(household id)). With a hid
+    the household list and load run concurrently; without one the list comes
+    first, to pick the first household as the default.
+    """
+    if hid:
+        hid = int(hid)
+        households, rows = await asyncio.gather(households_async(adb, current), load(hid))
+    else:
+        households = await households_async(adb, current)
+        hid = households[0].household_id if households else None
+        rows = await load(hid)
+    return households, hid, rows
 
 
 #
-# @app.route is a decorator around index() that means:
+# @views.route is a decorator around index() that means:
 #   run index() whenever the user tries to access the "/" path using a GET request
 #
 # If you wanted the user to go to, for example, localhost:8111/foobar/ with POST or GET then you could use:
 #
-#       @app.route("/foobar/", methods=["POST", "GET"])
+#       @views.route("/foobar/", methods=["POST", "GET"])
 #
 # PROTIP: (the trailing / in the path is important)
 # 
 # see for routing: https://flask.palletsprojects.com/en/1.1.x/quickstart/#routing
 # see for decorators: http://simeonfranklin.com/blog/2012/jul/1/python-decorators-in-12-steps/
 #
-@app.route('/')
+@views.route('/')
 def index():
 	"""
 	request is a special object that Flask provides to access web request information:
@@ -122,7 +315,7 @@ def index():
 	"""
 
 	# DEBUG: this is debugging code to see what request looks like
-	print(request.args)
+	current_app.logger.debug("index args: %s", request.args)
 
 
 	#
@@ -176,15 +369,15 @@ def index():
 #     localhost:8111/another
 #
 # Notice that the function name is another() rather than index()
-# The functions for each app.route need to have different names
+# The functions for each views.route need to have different names
 #
-@app.route('/another')
+@views.route('/another')
 def another():
 	return render_template("another.html")
 
 
 # Example of adding new data to the database
-@app.route('/add', methods=['POST'])
+@views.route('/add', methods=['POST'])
 def add():
 	# accessing form inputs from user
 	name = request.form['name']
@@ -197,30 +390,123 @@ def add():
 	return redirect('/')
 
 
-@app.route('/login')
+@views.route('/login')
 def login():
 	abort(401)
 	# Your IDE may highlight this as a problem - because no such function exists (intentionally).
 	# This code is never executed because of abort().
 	this_is_never_executed()
 
-@app.route('/recipes')
+RECIPES_PAGE_SIZE = 50
+# Similar recipes shown for /recipes?similar_to=<id>
+RECIPES_SIMILAR = 10
+
+
+def like_pattern(term):
+    """%term% for ILIKE, with the user's own wildcards escaped."""
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+
+@views.route('/recipes')
+@versions.conditional(lambda: ['recipes'], cache_control=f'public, max-age={RECIPES_MAX_AGE}')
 def recipes():
+    """
+    One page of the recipe catalog, optionally filtered by q (name or source).
+    Pages use keyset pagination on (recipe_name, recipe_id): the next page starts
+    after the last row of this one, so deep pages cost the same as the first.
+    similar_to=<recipe id> adds the recipes sharing the most ingredients with it.
+    """
+    q = request.args.get('q', '').strip()
+    similar_to = request.args.get('similar_to', type=int)
+    after_name = request.args.get('after_name')
+    after_id = request.args.get('after_id', type=int)
+    limit = min(max(request.args.get('limit', RECIPES_PAGE_SIZE, type=int), 1), 500)
+
+    after = after_name is not None and after_id is not None
+    params = {'limit': limit + 1}
+    if q:
+        params['pattern'] = like_pattern(q)
+    if after:
+        params['after_name'] = after_name
+        params['after_id'] = after_id
+
     try:
-        cursor = g.conn.execute(text("""
-            SELECT recipe_id, recipe_name, portion_size, source
-            FROM recipe
-            ORDER BY recipe_name
-        """))
+        cursor = g.conn.execute(queries.recipe_page(bool(q), after), params)
         rows = cursor.fetchall()
         cursor.close()
+        similar_name, similar = None, []
+        if similar_to is not None:
+            similar_name = recipe_similarity.recipe_name(db.primary(), similar_to)
+            similar = recipe_similarity.similar(db.primary(), similar_to, k=RECIPES_SIMILAR)
     except Exception as e:
         return f"<h3>Error querying recipes:</h3><pre>{e}</pre>"
-    return render_template("recipes.html", rows=rows)
+
+    # One extra row was fetched to know whether there is a next page
+    next_page = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_page = {'q': q or None, 'after_name': rows[-1].recipe_name, 'after_id': rows[-1].recipe_id, 'limit': limit}
+    return render_template("recipes.html", rows=rows, q=q, next_page=next_page,
+                           is_first_page=after_name is None, similar_name=similar_name, similar=similar)
+
+
+@views.route('/api/recipes/search')
+@versions.conditional(lambda: ['recipes'], cache_control=f'public, max-age={RECIPES_MAX_AGE}')
+def recipe_search():
+    """
+    Typeahead for the meal plan forms: up to limit recipes whose name contains q,
+    names starting with q first.
+    """
+    q = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    if not q:
+        return jsonify([])
+    try:
+        rows = g.conn.execute(queries.RECIPE_SEARCH, {'pattern': like_pattern(q), 'prefix': like_pattern(q)[1:], 'limit': limit}).fetchall()
+    except Exception as e:
+        return jsonify(error=str(e)), 500
+    return jsonify([{'recipe_id': r.recipe_id, 'recipe_name': r.recipe_name} for r in rows])
+
+
+@views.route('/api/recipes/<int:rid>/similar')
+@versions.conditional(lambda: ['recipes'], cache_control=f'public, max-age={RECIPES_MAX_AGE}')
+def similar_recipes(rid):
+    """
+    Up to k recipes sharing the most ingredients with the recipe, by Jaccard
+    (default) or cosine similarity of their ingredient sets (similarity.py).
+    """
+    k = min(max(request.args.get('k', 10, type=int), 1), 100)
+    metric = request.args.get('metric', 'jaccard')
+    if metric not in METRICS:
+        return jsonify(error=f"metric must be one of {', '.join(METRICS)}"), 400
+    try:
+        rows = recipe_similarity.similar(db.primary(), rid, k=k, metric=metric)
+    except Exception as e:
+        return jsonify(error=str(e)), 500
+    return jsonify([{'recipe_id': r.recipe_id, 'recipe_name': r.recipe_name, 'score': r.score,
+                     'shared_ingredients': r.shared} for r in rows])
+
+
+@views.route('/api/ingredients/<int:iid>/substitutes')
+def ingredient_substitutes(iid):
+    """
+    Up to k ingredients used in the same kind of recipes as the ingredient but
+    rarely alongside it (similarity.py). With hid, only ones the household has.
+    """
+    k = min(max(request.args.get('k', 5, type=int), 1), 50)
+    hid = request.args.get('hid', type=int)
+    try:
+        available = cookable_recipes.in_stock(db.primary(), hid) if hid is not None else None
+        rows = recipe_similarity.substitutes(db.primary(), iid, k=k, available=available)
+    except Exception as e:
+        return jsonify(error=str(e)), 500
+    return jsonify([{'ingredient_id': r.ingredient_id, 'ingredient_name': r.ingredient_name, 'score': r.score}
+                    for r in rows])
 
 
 
-@app.route('/households',methods=['GET', 'POST'])
+@views.route('/households',methods=['GET', 'POST'])
 def households():
     # Handle POST
     if request.method == 'POST':
@@ -229,10 +515,10 @@ def households():
             household_id = request.form.get('household_id')
             if household_id:
                 try:
-                    g.conn.execute(text("""
-                        DELETE FROM household WHERE household_id = :hid
-                    """), {'hid': household_id})
+                    g.conn.execute(queries.HOUSEHOLD_DELETE, {'hid': household_id})
+                    ref_cache.publish(g.conn, 'households', f'household:{household_id}')
                     g.conn.commit()
+                    ref_cache.invalidate('households', f'household:{household_id}')
                     return redirect('/households')
                 except Exception as e:
                     return f"<h3>Error deleting household:</h3><pre>{e}</pre>"
@@ -241,108 +527,226 @@ def households():
             household_name = request.form.get('household_name')
             if household_name:
                 try:
-                    g.conn.execute(text("""
-                        INSERT INTO household (household_name) 
-                        VALUES (:name)
-                    """), {'name': household_name})
+                    g.conn.execute(queries.HOUSEHOLD_INSERT, {'name': household_name})
+                    ref_cache.publish(g.conn, 'households')
                     g.conn.commit()
+                    ref_cache.invalidate('households')
                     return redirect('/households')
                 except Exception as e:
                     return f"<h3>Error adding household:</h3><pre>{e}</pre>"
     
     # Handle GET - Display households
     try:
-        cursor = g.conn.execute(text("SELECT household_id, household_name FROM household ORDER BY household_name"))
-        data = cursor.fetchall()
-        cursor.close()
+        data = household_list()
     except Exception as e:
         return f"<h3>Error querying households:</h3><pre>{e}</pre>"
     return render_template("households.html", households=data)
 
 
 
-@app.route('/inventory', methods=['GET', 'POST'])
+@views.route('/inventory', methods=['GET', 'POST'])
 def inventory():
     try:
-        # Fetch households and ingredients (with their units)
-        households = g.conn.execute(text(
-            "SELECT household_id, household_name FROM household ORDER BY household_name"
-        )).fetchall()
-        ingredients = g.conn.execute(text(
-            "SELECT ingredient_id, ingredient_name, unit FROM ingredient ORDER BY ingredient_name"
-        )).fetchall()
-
-        sel_hid = request.args.get('hid') or (str(households[0].household_id) if households else None)
+        sel_hid = request.args.get('hid')
+        import_result = None
 
         # Handle form submission
         if request.method == 'POST':
             hid = request.form.get('hid')
             iid = request.form.get('iid')
             qty = request.form.get('quantity')
-
-            if hid and iid and qty:
+            upload = request.files.get('file')
+
+            if hid and upload and upload.filename:
+                # Bulk import from an uploaded CSV or JSON file; the report is shown on this page
+                if upload.filename.lower().endswith('.json'):
+                    rows, errors = inventory_import.parse_json(json.load(upload.stream))
+                else:
+                    rows, errors = inventory_import.parse_csv(io.TextIOWrapper(upload.stream, encoding='utf-8-sig'))
+                import_result = import_household_inventory(hid, rows, errors)
+                sel_hid = hid
+            elif hid and iid and qty:
                 # Automatically apply unit from ingredient table
-                g.conn.execute(text("""
-                    INSERT INTO household_in_inventory_ingredient (household_id, ingredient_id, quantity, unit)
-                    VALUES (:hid, :iid, :qty, (SELECT unit FROM ingredient WHERE ingredient_id = :iid))
-                    ON CONFLICT (household_id, ingredient_id)
-                    DO UPDATE SET quantity = household_in_inventory_ingredient.quantity + EXCLUDED.quantity,
-                                  unit = EXCLUDED.unit
-                """), {'hid': hid, 'iid': iid, 'qty': qty})
+                g.conn.execute(queries.INVENTORY_ADD, {'hid': hid, 'iid': iid, 'qty': qty})
+                versions.bump(g.conn, f'household:{hid}')
+                ref_cache.publish(g.conn, f'household:{hid}')
                 g.conn.commit()
+                versions.invalidate()
+                ref_cache.invalidate(f'household:{hid}')
                 return redirect(f"/inventory?hid={hid}")
 
-        # If household is selected, show its inventory
-        items = None
-        if sel_hid:
-            items = g.conn.execute(text("""
-                SELECT i.ingredient_name, hi.quantity, hi.unit
-                FROM household_in_inventory_ingredient hi
-                JOIN ingredient i ON i.ingredient_id = hi.ingredient_id
-                WHERE hi.household_id = :hid
-                ORDER BY i.ingredient_name
-            """), {'hid': sel_hid}).fetchall()
+        # Households, ingredients (with their units) and the selected household's
+        # inventory load concurrently, each on its own connection
+        adb = aio.get_db()
+        households, ingredients, items, sel_hid = adb.run(load_inventory_page(adb, sel_hid, versions.current()))
+        sel_hid = str(sel_hid) if sel_hid else None
 
         return render_template("inventory.html",
-                               households=households,
-                               ingredients=ingredients,
+                               household_options=household_options(households, sel_hid),
+                               ingredient_options=ingredient_options(ingredients),
                                items=items,
-                               sel_hid=str(sel_hid) if sel_hid else None)
+                               import_result=import_result,
+                               sel_hid=sel_hid)
 
     except Exception as e:
         return f"<h3>Error querying inventory:</h3><pre>{e}</pre>"
 
+
+async def load_inventory_page(adb, hid, current):
+    """
+    Returns (households, ingredients, the household's inventory, household id).
+    current is versions.current(); the cached lists are at least that new.
+    """
+    async def inventory_items(hid):
+        if not hid:
+            return None
+        return await adb.fetch(queries.INVENTORY_ITEMS, {'hid': hid})
+
+    async def load(hid):
+        # Ingredients belong to the 'recipes' resource
+        return await asyncio.gather(ref_cache.get_async('ingredients', lambda: adb.primary.fetch(queries.INGREDIENTS),
+                                                        version=versions.version('recipes', current)),
+                                    inventory_items(hid))
+
+    households, hid, (ingredients, items) = await gather_for_household(adb, hid, load, current)
+    return households, ingredients, items, hid
+
+
+def import_household_inventory(hid, rows, errors):
+    """Runs a bulk import in one transaction and returns {'imported': n, 'errors': [...]}."""
+    _, unknown = inventory_import.import_inventory(g.conn, hid, rows)
+    versions.bump(g.conn, f'household:{hid}')
+    ref_cache.publish(g.conn, f'household:{hid}')
+    g.conn.commit()
+    versions.invalidate()
+    ref_cache.invalidate(f'household:{hid}')
+    return {'imported': len(rows) - len(unknown),
+            'errors': sorted(errors + unknown, key=lambda e: e['line'])}
+
+
+@views.route('/api/households/<int:hid>/inventory', methods=['POST'])
+def inventory_import_api(hid):
+    """
+    Bulk inventory import. Accepts a JSON list of {"ingredient": id or name, "quantity": n}
+    or a CSV body (Content-Type: text/csv) and returns the number of rows imported
+    and the rows that were rejected.
+    """
+    if request.mimetype == 'text/csv':
+        rows, errors = inventory_import.parse_csv(io.StringIO(request.get_data(as_text=True)))
+    else:
+        data = request.get_json(silent=True)
+        if data is None:
+            return jsonify(error='expected a JSON list or a text/csv body'), 400
+        rows, errors = inventory_import.parse_json(data)
+    try:
+        result = import_household_inventory(hid, rows, errors)
+    except Exception as e:
+        return jsonify(error=str(e)), 500
+    return jsonify(result)
+
     
 
-@app.route('/cookable')
+def cook_for_household(hid, selections=None, plan_id=None):
+    """
+    Cooks recipes (or a whole meal plan) from the household's inventory and
+    commits. Returns (consumed, shortfalls); with any shortfall nothing is cooked.
+    """
+    if plan_id is not None:
+        consumed, shortfalls = cooking.cook_plan(g.conn, hid, plan_id)
+    else:
+        consumed, shortfalls = cooking.cook(g.conn, hid, selections)
+    if shortfalls:
+        # Releases the inventory row locks
+        g.conn.rollback()
+        return {}, shortfalls
+    versions.bump(g.conn, f'household:{hid}')
+    ref_cache.publish(g.conn, f'household:{hid}')
+    g.conn.commit()
+    versions.invalidate()
+    ref_cache.invalidate(f'household:{hid}')
+    return consumed, []
+
+
+@views.route('/cookable', methods=['GET', 'POST'])
+@versions.conditional(household_page_resources)
 def cookable():
+    # Cook a recipe: its ingredients come out of the inventory
+    if request.method == 'POST':
+        hid = request.form.get('hid')
+        recipe_id = request.form.get('recipe_id')
+        if hid and recipe_id:
+            try:
+                selections = meal_plans.parse_selections([recipe_id], [request.form.get('servings')])
+                _, shortfalls = cook_for_household(hid, selections)
+            except Exception as e:
+                return f"<h3>Error cooking recipe:</h3><pre>{escape(str(e))}</pre>"
+            if shortfalls:
+                return f"<h3>Not enough in stock to cook this recipe:</h3><pre>{escape(cooking.describe(shortfalls))}</pre>"
+        return redirect(f"/cookable?hid={hid}")
+
     try:
-        households = g.conn.execute(text("SELECT household_id, household_name FROM household ORDER BY household_name")).fetchall()
+        households = household_list()
         sel_hid = request.args.get("hid", str(households[0].household_id) if households else None)
+        # mode=ranked lists "almost cookable" recipes by missing or insufficient ingredients
+        ranked = request.args.get("mode") == "ranked"
+        k = min(max(request.args.get("k", 20, type=int), 1), 100)
+        max_missing = request.args.get("max_missing", None, type=int)
+        if max_missing is not None:
+            max_missing = max(max_missing, 0)
         rows = []
+        substitutes = {}
         if sel_hid:
-            rows = g.conn.execute(text("""
-                SELECT DISTINCT r.recipe_id, r.recipe_name, r.portion_size
-                FROM recipe r
-                WHERE NOT EXISTS (
-                    SELECT 1
-                    FROM recipe_made_with_ingredient ri
-                    WHERE ri.recipe_id = r.recipe_id
-                      AND ri.ingredient_id NOT IN (
-                          SELECT hi.ingredient_id
-                          FROM household_in_inventory_ingredient hi
-                          WHERE hi.household_id = :hid
-                      )
-                )
-                ORDER BY r.recipe_name
-            """), {'hid': sel_hid}).fetchall()
+            if ranked:
+                rows = cookable_recipes.ranked(db.primary(), sel_hid, k=k, max_missing=max_missing)
+                # Stand-ins the household already has for each missing ingredient
+                in_stock = cookable_recipes.in_stock(db.primary(), sel_hid)
+                for iid in {iid for r in rows for iid in r.missing_ingredient_ids}:
+                    substitutes[iid] = [s.ingredient_name for s in
+                                        recipe_similarity.substitutes(db.primary(), iid, k=2, available=in_stock)]
+            else:
+                rows = cookable_recipes.cookable(db.primary(), sel_hid)
     except Exception as e:
         return f"<h3>Error querying cookable recipes:</h3><pre>{e}</pre>"
-    return render_template("cookable.html", households=households, rows=rows, sel_hid=str(sel_hid) if sel_hid else None)
-
-
-
-@app.route('/mealplans', methods=['GET', 'POST'])
+    sel_hid = str(sel_hid) if sel_hid else None
+    return render_template("cookable.html", household_options=household_options(households, sel_hid), rows=rows,
+                           sel_hid=sel_hid, ranked=ranked, k=k, max_missing=max_missing, substitutes=substitutes)
+
+
+
+async def load_mealplans_page(adb, hid, current):
+    """
+    Returns (households, plan_details, household id) for mealplans.html.
+    current is versions.current(), read before any of the data.
+    The household's plans, their recipes and their grocery lines are three
+    queries that run concurrently (and alongside the household list on a
+    cache miss); the rows are grouped by plan in Python.
+    """
+    async def load(hid):
+        if not hid:
+            return [], [], []
+        return await asyncio.gather(adb.fetch(queries.HOUSEHOLD_PLANS, {'hid': hid}),
+                                    adb.fetch(queries.HOUSEHOLD_PLAN_RECIPES, {'hid': hid}),
+                                    adb.fetch(queries.HOUSEHOLD_GROCERY_LINES, {'hid': hid}))
+
+    households, hid, (plans, recipes, groceries) = await gather_for_household(adb, hid, load, current)
+    recipes_by_plan = {plan.plan_id: [] for plan in plans}
+    groceries_by_plan = {plan.plan_id: [] for plan in plans}
+    for row in recipes:
+        recipes_by_plan[row.plan_id].append(row)
+    for row in groceries:
+        groceries_by_plan[row.plan_id].append(row)
+
+    plan_details = [{
+        'plan_id': plan.plan_id,
+        'label': plan.label,
+        'recipes': recipes_by_plan[plan.plan_id],
+        'groceries': groceries_by_plan[plan.plan_id]
+    } for plan in plans]
+    return households, plan_details, hid
+
+
+@views.route('/mealplans', methods=['GET', 'POST'])
+@versions.conditional(household_page_resources)
 def mealplans():
     # Handle POST
     if request.method == 'POST':
@@ -352,73 +756,44 @@ def mealplans():
             household_id = request.form.get('hid')
             if plan_id:
                 try:
-                    # Delete grocery list ingredients first
-                    g.conn.execute(text("""
-                        DELETE FROM grocery_list_contains_ingredients
-                        WHERE grocery_id IN (SELECT grocery_id FROM grocery_list WHERE plan_id = :pid)
-                    """), {'pid': plan_id})
-                    
-                    # Delete grocery list
-                    g.conn.execute(text("""
-                        DELETE FROM grocery_list WHERE plan_id = :pid
-                    """), {'pid': plan_id})
-                    
-                    # Delete meal plan recipe links
-                    g.conn.execute(text("""
-                        DELETE FROM meal_plan_selects_recipe WHERE plan_id = :pid
-                    """), {'pid': plan_id})
-                    
-                    # Delete meal plan
-                    g.conn.execute(text("""
-                        DELETE FROM meal_plans WHERE plan_id = :pid
-                    """), {'pid': plan_id})
-                    
+                    versions.bump(g.conn, plan_ids=[plan_id])
+                    # Recipe links and the grocery list go with it (ON DELETE CASCADE)
+                    meal_plans.delete_plan(g.conn, plan_id)
                     g.conn.commit()
+                    versions.invalidate()
                     return redirect(f'/mealplans?hid={household_id}')
                 except Exception as e:
                     return f"<h3>Error deleting meal plan:</h3><pre>{e}</pre>"
+        # Cook every recipe in the plan from the household's inventory
+        elif request.form.get('action') == 'cook':
+            plan_id = request.form.get('plan_id')
+            household_id = request.form.get('hid')
+            if plan_id and household_id:
+                try:
+                    _, shortfalls = cook_for_household(household_id, plan_id=plan_id)
+                except Exception as e:
+                    return f"<h3>Error cooking meal plan:</h3><pre>{escape(str(e))}</pre>"
+                if shortfalls:
+                    return f"<h3>Not enough in stock to cook this plan:</h3><pre>{escape(cooking.describe(shortfalls))}</pre>"
+                return redirect(f'/cookable?hid={household_id}')
         # Check if this is an add recipe to plan request
         elif request.form.get('action') == 'add_recipe':
             plan_id = request.form.get('plan_id')
-            recipe_id = request.form.get('recipe_id')
+            # One or more recipes, each with optional servings
+            recipe_ids = [rid for rid in request.form.getlist('recipe_id') if rid]
             household_id = request.form.get('hid')
             
-            if plan_id and recipe_id:
+            if plan_id and recipe_ids:
                 try:
-                    # Check if recipe is already in this plan
-                    existing = g.conn.execute(text("""
-                        SELECT 1 FROM meal_plan_selects_recipe 
-                        WHERE plan_id = :pid AND recipe_id = :rid
-                    """), {'pid': plan_id, 'rid': recipe_id}).fetchone()
-                    
-                    if not existing:
-                        # Link recipe to meal plan
-                        g.conn.execute(text("""
-                            INSERT INTO meal_plan_selects_recipe (plan_id, recipe_id)
-                            VALUES (:pid, :rid)
-                        """), {'pid': plan_id, 'rid': recipe_id})
-                        
-                        # Get grocery list for this plan
-                        grocery = g.conn.execute(text("""
-                            SELECT grocery_id FROM grocery_list WHERE plan_id = :pid
-                        """), {'pid': plan_id}).fetchone()
-                        
-                        if grocery:
-                            grocery_id = grocery[0]
-                            # Add recipe ingredients to grocery list (update quantities if already exists)
-                            g.conn.execute(text("""
-                                INSERT INTO grocery_list_contains_ingredients (grocery_id, ingredient_id, quantity, unit)
-                                SELECT :gid, ingredient_id, quantity, unit
-                                FROM recipe_made_with_ingredient
-                                WHERE recipe_id = :rid
-                                ON CONFLICT (grocery_id, ingredient_id)
-                                DO UPDATE SET quantity = grocery_list_contains_ingredients.quantity + EXCLUDED.quantity
-                            """), {'gid': grocery_id, 'rid': recipe_id})
-                        
-                        g.conn.commit()
+                    selections = meal_plans.parse_selections(recipe_ids, request.form.getlist('servings'))
+                    # Recipes already in the plan are left alone
+                    meal_plans.add_recipes(g.conn, plan_id, selections)
+                    versions.bump(g.conn, plan_ids=[plan_id])
+                    g.conn.commit()
+                    versions.invalidate()
                     return redirect(f'/mealplans?hid={household_id}')
                 except Exception as e:
-                    return f"<h3>Error adding recipe to plan:</h3><pre>{e}</pre>"
+                    return f"<h3>Error adding recipe to plan:</h3><pre>{escape(str(e))}</pre>"
         else:
             # Add new meal plan
             household_id = request.form.get('hid')
@@ -427,105 +802,177 @@ def mealplans():
             
             if household_id and recipe_id and label:
                 try:
-                    # Insert meal plan
-                    result = g.conn.execute(text("""
-                        INSERT INTO meal_plans (household_id, label) 
-                        VALUES (:hid, :label)
-                        RETURNING plan_id
-                    """), {'hid': household_id, 'label': label})
-                    plan_id = result.fetchone()[0]
-                    
-                    # Link recipe to meal plan
-                    g.conn.execute(text("""
-                        INSERT INTO meal_plan_selects_recipe (plan_id, recipe_id)
-                        VALUES (:pid, :rid)
-                    """), {'pid': plan_id, 'rid': recipe_id})
-                    
-                    # Create grocery list
-                    result = g.conn.execute(text("""
-                        INSERT INTO grocery_list (plan_id)
-                        VALUES (:pid)
-                        RETURNING grocery_id
-                    """), {'pid': plan_id})
-                    grocery_id = result.fetchone()[0]
-                    
-                    # Add recipe ingredients to grocery list
-                    g.conn.execute(text("""
-                        INSERT INTO grocery_list_contains_ingredients (grocery_id, ingredient_id, quantity, unit)
-                        SELECT :gid, ingredient_id, quantity, unit
-                        FROM recipe_made_with_ingredient
-                        WHERE recipe_id = :rid
-                    """), {'gid': grocery_id, 'rid': recipe_id})
-                    
+                    # Plan, recipe link, grocery list and its ingredients in one statement
+                    meal_plans.create_plan(g.conn, household_id, label, recipe_id)
+                    versions.bump(g.conn, f'household:{household_id}')
                     g.conn.commit()
+                    versions.invalidate()
                     return redirect(f'/mealplans?hid={household_id}')
                 except Exception as e:
                     return f"<h3>Error adding meal plan:</h3><pre>{e}</pre>"
     
     # Handle GET - Display meal plans
     try:
-        # Fetch households
-        households = g.conn.execute(text("""
-            SELECT household_id, household_name 
-            FROM household 
-            ORDER BY household_name
-        """)).fetchall()
-        
-        # Get selected household
-        sel_hid = request.args.get('hid', str(households[0].household_id) if households else None)
-        
-        # Fetch recipes for the add form
-        all_recipes = g.conn.execute(text("""
-            SELECT recipe_id, recipe_name
-            FROM recipe
-            ORDER BY recipe_name
-        """)).fetchall()
-        
-        # Fetch meal plans for selected household
-        plans = []
-        if sel_hid:
-            plans = g.conn.execute(text("""
-                SELECT mp.plan_id, mp.label
-                FROM meal_plans mp
-                WHERE mp.household_id = :hid
-                ORDER BY mp.label
-            """), {'hid': sel_hid}).fetchall()
-        
-        # Get details for each plan
-        plan_details = []
-        for plan in plans:
-            recipes = g.conn.execute(text("""
-                SELECT r.recipe_name
-                FROM meal_plan_selects_recipe mpsr
-                JOIN recipe r ON r.recipe_id = mpsr.recipe_id
-                WHERE mpsr.plan_id = :pid
-                ORDER BY r.recipe_name
-            """), {'pid': plan.plan_id}).fetchall()
-            
-            groceries = g.conn.execute(text("""
-                SELECT i.ingredient_name, gci.quantity, gci.unit
-                FROM grocery_list gl
-                JOIN grocery_list_contains_ingredients gci ON gci.grocery_id = gl.grocery_id
-                JOIN ingredient i ON i.ingredient_id = gci.ingredient_id
-                WHERE gl.plan_id = :pid
-                ORDER BY i.ingredient_name
-            """), {'pid': plan.plan_id}).fetchall()
-            
-            plan_details.append({
-                'plan_id': plan.plan_id,
-                'label': plan.label,
-                'recipes': recipes,
-                'groceries': groceries
-            })
+        # Versions first: cached cards are keyed by what the data was at least as new as
+        current = versions.current()
+        # Households, plans, plan recipes and grocery lines in concurrent queries (see aio.py)
+        adb = aio.get_db()
+        households, plan_details, sel_hid = adb.run(load_mealplans_page(adb, request.args.get('hid'), current))
+        sel_hid = str(sel_hid) if sel_hid else None
+        plan_cards = [plan_card(plan, sel_hid, current) for plan in plan_details]
             
     except Exception as e:
         return f"<h3>Error querying meal plans:</h3><pre>{e}</pre>"
     
     return render_template("mealplans.html", 
-                         households=households, 
-                         sel_hid=str(sel_hid) if sel_hid else None,
-                         all_recipes=all_recipes,
-                         plan_details=plan_details)
+                         household_options=household_options(households, sel_hid), 
+                         sel_hid=sel_hid,
+                         plan_cards=plan_cards)
+
+
+
+@views.route('/api/mealplans/<int:pid>/recipes', methods=['POST'])
+def mealplan_recipes_api(pid):
+    """
+    Adds several recipes to a plan at once. Accepts a JSON list of recipe ids
+    or of {"recipe_id": id, "servings": n} objects and returns the ids added.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        return jsonify(error='expected a JSON list of recipe ids or {recipe_id, servings} objects'), 400
+    items = [item if isinstance(item, dict) else {'recipe_id': item} for item in data]
+    try:
+        selections = meal_plans.parse_selections([item.get('recipe_id') for item in items],
+                                                 [item.get('servings') for item in items])
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    try:
+        added = meal_plans.add_recipes(g.conn, pid, selections)
+        versions.bump(g.conn, plan_ids=[pid])
+        g.conn.commit()
+        versions.invalidate()
+    except LookupError as e:
+        return jsonify(error=str(e)), 404
+    except Exception as e:
+        return jsonify(error=str(e)), 500
+    return jsonify(added=added, skipped=len({rid for rid, _ in selections}) - len(added))
+
+
+@views.route('/api/households/<int:hid>/cook', methods=['POST'])
+def cook_api(hid):
+    """
+    Cooks {"recipes": [recipe id or {"recipe_id": id, "servings": n}, ...]} or
+    {"plan_id": id} from the household's inventory. Returns what is left of
+    each ingredient used and the recipes still cookable, or 409 with the
+    shortfalls when anything is missing (nothing is cooked then).
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not (isinstance(data.get('recipes'), list) or 'plan_id' in data):
+        return jsonify(error='expected {"recipes": [...]} or {"plan_id": id}'), 400
+    try:
+        if 'plan_id' in data:
+            consumed, shortfalls = cook_for_household(hid, plan_id=int(data['plan_id']))
+        else:
+            items = [item if isinstance(item, dict) else {'recipe_id': item} for item in data['recipes']]
+            selections = meal_plans.parse_selections([item.get('recipe_id') for item in items],
+                                                     [item.get('servings') for item in items])
+            consumed, shortfalls = cook_for_household(hid, selections)
+    except (TypeError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+    except Exception as e:
+        return jsonify(error=str(e)), 500
+    if shortfalls:
+        return jsonify(error='not enough in stock', shortfalls=[
+            {'ingredient_id': s.ingredient_id, 'ingredient_name': s.ingredient_name, 'unit': s.unit,
+             'needed': float(s.needed) if s.needed is not None else None, 'in_stock': float(s.in_stock or 0)}
+            for s in shortfalls]), 409
+    try:
+        still_cookable = cookable_recipes.cookable(db.primary(), hid)
+    except Exception as e:
+        return jsonify(error=str(e)), 500
+    return jsonify(consumed={str(iid): float(qty) for iid, qty in consumed.items()},
+                   cookable=[{'recipe_id': r.recipe_id, 'recipe_name': r.recipe_name} for r in still_cookable])
+
+
+@views.route('/api/households/<int:hid>/stats')
+@versions.conditional(lambda: ['recipes', f"household:{request.view_args['hid']}"])
+def household_stats(hid):
+    """
+    A household's most planned recipes and grocery totals (from the rollups in
+    rollups.py), plus the ingredients that most often block an almost
+    cookable recipe (from the in-process cookable index).
+    """
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    max_missing = min(max(request.args.get('max_missing', 1, type=int), 1), 5)
+    try:
+        top = rollups.top_recipes(g.conn, hid, limit)
+        totals = rollups.grocery_totals(g.conn, hid)
+        blocking = cookable_recipes.blocking_ingredients(db.primary(), hid, max_missing=max_missing, k=limit)
+    except Exception as e:
+        return jsonify(error=str(e)), 500
+    return jsonify(
+        household_id=hid,
+        top_recipes=[{'recipe_id': r.recipe_id, 'recipe_name': r.recipe_name, 'plans': r.plans} for r in top],
+        grocery_totals=[{'ingredient_id': r.ingredient_id, 'ingredient_name': r.ingredient_name,
+                         'unit': r.unit or None, 'quantity': float(r.quantity), 'lines': r.lines}
+                        for r in totals],
+        blocking_ingredients=[{'ingredient_id': iid, 'ingredient_name': name, 'recipes': count}
+                              for iid, name, count in blocking],
+    )
+
+
+@views.route('/shopping')
+def shopping_list():
+    """
+    One shopping list for several meal plans: /shopping?hid=1&pid=3&pid=5.
+    Quantities are summed across plans in compatible units and reduced by
+    what the household already has.
+    """
+    sel_hid = request.args.get('hid', type=int)
+    pids = request.args.getlist('pid', type=int)
+    try:
+        plans = []
+        rows = []
+        if sel_hid and pids:
+            plans = g.conn.execute(queries.SHOPPING_PLANS, {'hid': sel_hid, 'pids': pids}).fetchall()
+            rows = shopping.shopping_list(g.conn, sel_hid, pids)
+    except Exception as e:
+        return f"<h3>Error building shopping list:</h3><pre>{e}</pre>"
+    return render_template("shopping.html", sel_hid=sel_hid, plans=plans, rows=rows)
+
+
+def wants_gzip():
+    return request.args.get('gzip') in ('1', 'true', 'yes')
+
+
+@views.route('/export/plans/<int:pid>/groceries.<any(csv, json):fmt>')
+def export_plan_groceries(pid, fmt):
+    """Streams one meal plan's grocery list as CSV or JSON (?gzip=1 to compress)."""
+    return exports.grocery_export(fmt, f"plan-{pid}-groceries",
+                           where="WHERE mp.plan_id = :pid", params={'pid': pid},
+                           gzip=wants_gzip())
+
+
+@views.route('/export/households/<int:hid>/groceries.<any(csv, json):fmt>')
+def export_household_groceries(hid, fmt):
+    """Streams the grocery lists of all of a household's meal plans."""
+    return exports.grocery_export(fmt, f"household-{hid}-groceries",
+                           where="WHERE mp.household_id = :hid", params={'hid': hid},
+                           gzip=wants_gzip())
+
+
+@views.route('/admin/export/groceries.<any(csv, json):fmt>')
+def export_all_groceries(fmt):
+    """
+    Streams every household's grocery lists. Requires the ADMIN_TOKEN from .env
+    in an X-Admin-Token header; disabled when ADMIN_TOKEN is unset. Not accepted
+    in the query string, which ends up in the access log.
+    """
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token or not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(),
+                                                  admin_token.encode()):
+        abort(403)
+    return exports.grocery_export(fmt, "all-groceries", gzip=wants_gzip())
 
 
 
@@ -552,6 +999,7 @@ if __name__ == "__main__":
 
 		HOST, PORT = host, port
 		print("running on %s:%d" % (HOST, PORT))
+		app = create_app()
 		app.run(host=HOST, port=PORT, debug=debug, threaded=threaded)
 
-run()
+	run()
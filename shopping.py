@@ -0,0 +1,67 @@
+"""
+Consolidated shopping list for several of a household's meal plans.
+
+One statement aggregates the grocery lines of the selected plans, converts
+each line to the ingredient's own unit when unit_conversion says the units
+are compatible (g/kg, tsp/tbsp/cup, ...), and subtracts what the household
+already has in stock. Lines in a unit that cannot be converted are kept as
+their own row and are not matched against inventory.
+"""
+from sqlalchemy import text
+
+# Conversion to the ingredient's unit is the CASE used twice below:
+# same unit -> quantity; same base unit -> quantity * from.factor / to.factor; otherwise NULL
+SHOPPING_LIST_QUERY = text("""
+    WITH lines AS (
+        SELECT gci.ingredient_id, gci.quantity, lower(trim(gci.unit)) AS unit
+        FROM meal_plans mp
+        JOIN grocery_list gl ON gl.plan_id = mp.plan_id
+        JOIN grocery_list_contains_ingredients gci ON gci.grocery_id = gl.grocery_id
+        WHERE mp.household_id = :hid
+          AND mp.plan_id = ANY(:pids)
+    ), converted AS (
+        SELECT l.ingredient_id, l.unit, l.quantity,
+               CASE WHEN l.unit = lower(trim(i.unit)) THEN l.quantity
+                    WHEN fc.base_unit = tc.base_unit THEN l.quantity * fc.factor / tc.factor
+               END AS base_quantity
+        FROM lines l
+        JOIN ingredient i ON i.ingredient_id = l.ingredient_id
+        LEFT JOIN unit_conversion fc ON fc.unit = l.unit
+        LEFT JOIN unit_conversion tc ON tc.unit = lower(trim(i.unit))
+    ), needed AS (
+        SELECT ingredient_id,
+               base_quantity IS NOT NULL AS in_ingredient_unit,
+               CASE WHEN base_quantity IS NULL THEN unit END AS other_unit,
+               SUM(COALESCE(base_quantity, quantity)) AS quantity
+        FROM converted
+        GROUP BY 1, 2, 3
+    ), stock AS (
+        SELECT hi.ingredient_id,
+               SUM(CASE WHEN lower(trim(hi.unit)) = lower(trim(i.unit)) THEN hi.quantity
+                        WHEN fc.base_unit = tc.base_unit THEN hi.quantity * fc.factor / tc.factor
+                        ELSE 0
+                   END) AS quantity
+        FROM household_in_inventory_ingredient hi
+        JOIN ingredient i ON i.ingredient_id = hi.ingredient_id
+        LEFT JOIN unit_conversion fc ON fc.unit = lower(trim(hi.unit))
+        LEFT JOIN unit_conversion tc ON tc.unit = lower(trim(i.unit))
+        WHERE hi.household_id = :hid
+        GROUP BY hi.ingredient_id
+    )
+    SELECT n.ingredient_id, i.ingredient_name,
+           CASE WHEN n.in_ingredient_unit THEN i.unit ELSE n.other_unit END AS unit,
+           n.quantity AS needed,
+           CASE WHEN n.in_ingredient_unit THEN COALESCE(s.quantity, 0) ELSE 0 END AS in_stock,
+           GREATEST(n.quantity - CASE WHEN n.in_ingredient_unit THEN COALESCE(s.quantity, 0) ELSE 0 END, 0) AS to_buy
+    FROM needed n
+    JOIN ingredient i ON i.ingredient_id = n.ingredient_id
+    LEFT JOIN stock s ON s.ingredient_id = n.ingredient_id
+    ORDER BY i.ingredient_name, unit
+""")
+
+
+def shopping_list(conn, household_id, plan_ids):
+    """Every ingredient needed by the plans, with how much is in stock and how much to buy."""
+    if not plan_ids:
+        return []
+    return conn.execute(SHOPPING_LIST_QUERY, {'hid': household_id, 'pids': list(plan_ids)}).fetchall()
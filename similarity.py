@@ -0,0 +1,127 @@
+"""
+"Similar recipes" and ingredient substitutions from the shared recipe x
+ingredient matrix (recipe_matrix.py).
+
+Lookups are a few NumPy passes over the matrix's CSR arrays (ingredients per
+recipe) and CSC arrays (recipes per ingredient) and never run SQL. Results
+are memoized on the matrix, so they last until it is reloaded after the
+recipe catalog changes.
+
+similar() ranks recipes by the Jaccard (or cosine) similarity of their
+ingredient sets. substitutes() ranks ingredients that are used in the same
+kind of recipes as the given one but rarely together with it:
+
+    context[l]  = share of the ingredient's recipes that also use l
+    resemble[r] = mean context of r's ingredients, for recipes without it
+    score[j]    = sum of resemble[r] over recipes r using j / sqrt(recipes using j)
+                  * (1 - share of the ingredient's recipes that also use j)
+"""
+from collections import namedtuple
+
+import numpy as np
+
+SimilarRecipe = namedtuple('SimilarRecipe', ['recipe_id', 'recipe_name', 'score', 'shared'])
+Substitute = namedtuple('Substitute', ['ingredient_id', 'ingredient_name', 'score'])
+
+METRICS = ('jaccard', 'cosine')
+
+# Ranked results kept per recipe or ingredient (substitutes are then filtered
+# by what a household has, so the list runs deeper than any one page needs)
+_DEPTH = 100
+
+
+def _similar(matrix, row, metric):
+    """[(row, score, shared ingredients)] best first, at most _DEPTH."""
+    mine = matrix.cols[matrix.indptr[row]:matrix.indptr[row + 1]]
+    if not len(mine):
+        return []
+    shared = np.bincount(np.concatenate([matrix.recipes_using(col) for col in mine]),
+                         minlength=len(matrix.recipes))
+    shared[row] = 0
+    candidates = np.flatnonzero(shared)
+    inter = shared[candidates]
+    if metric == 'cosine':
+        scores = inter / np.sqrt(len(mine) * matrix.sizes[candidates])
+    else:
+        scores = inter / (len(mine) + matrix.sizes[candidates] - inter)
+    # Only the best _DEPTH are kept: everything scoring at least the
+    # _DEPTH-th best score, then by score and row (rows are in name order)
+    if len(scores) > _DEPTH:
+        keep = scores >= np.partition(scores, -_DEPTH)[-_DEPTH]
+        candidates, scores, inter = candidates[keep], scores[keep], inter[keep]
+    order = np.lexsort((candidates, -scores))[:_DEPTH]
+    return list(zip(candidates[order].tolist(), scores[order].tolist(), inter[order].tolist()))
+
+
+def _substitutes(matrix, col):
+    """[(column, score)] best first, at most _DEPTH."""
+    users = matrix.recipes_using(col)
+    if not len(users):
+        return []
+    uses = np.zeros(len(matrix.recipes), dtype=bool)
+    uses[users] = True
+    together = np.bincount(matrix.cols[uses[matrix.rows]], minlength=len(matrix.ingredient_ids)) / len(users)
+    context = together.copy()
+    context[col] = 0.0
+
+    resemble = np.bincount(matrix.rows, weights=context[matrix.cols], minlength=len(matrix.recipes))
+    resemble = resemble / np.maximum(matrix.sizes, 1)
+    resemble[uses] = 0.0
+
+    scores = np.bincount(matrix.cols, weights=resemble[matrix.rows], minlength=len(matrix.ingredient_ids))
+    scores = scores / np.sqrt(np.maximum(matrix.freq, 1)) * (1.0 - together)
+    scores[col] = 0.0
+    candidates = np.flatnonzero(scores > 0)
+    order = candidates[np.argsort(-scores[candidates], kind='stable')][:_DEPTH]
+    return list(zip(order.tolist(), scores[order].tolist()))
+
+
+class RecipeSimilarity:
+
+    def __init__(self, matrices):
+        """matrices is the shared recipe_matrix.RecipeMatrices."""
+        self.matrices = matrices
+
+    def recipe_name(self, conn, recipe_id):
+        """The recipe's name, or None for an unknown recipe."""
+        matrix = self.matrices.get(conn)
+        row = matrix.row_of.get(int(recipe_id))
+        return matrix.recipes[row].recipe_name if row is not None else None
+
+    def similar(self, conn, recipe_id, k=10, metric='jaccard'):
+        """Up to k recipes sharing ingredients with recipe_id, most similar first."""
+        if metric not in METRICS:
+            raise ValueError(f"metric must be one of {', '.join(METRICS)}")
+        matrix = self.matrices.get(conn)
+        row = matrix.row_of.get(int(recipe_id))
+        if row is None:
+            return []
+        key = ('similar', row, metric)
+        ranked = matrix.memo.get(key)
+        if ranked is None:
+            ranked = matrix.memo[key] = _similar(matrix, row, metric)
+        return [SimilarRecipe(matrix.recipes[r].recipe_id, matrix.recipes[r].recipe_name, round(score, 4), shared)
+                for r, score, shared in ranked[:k]]
+
+    def substitutes(self, conn, ingredient_id, k=5, available=None):
+        """
+        Up to k ingredients that could stand in for ingredient_id, best first.
+        available (a set of ingredient ids, e.g. a household's stock) limits
+        the suggestions to those.
+        """
+        matrix = self.matrices.get(conn)
+        col = matrix.col_of.get(int(ingredient_id))
+        if col is None:
+            return []
+        key = ('substitutes', col)
+        ranked = matrix.memo.get(key)
+        if ranked is None:
+            ranked = matrix.memo[key] = _substitutes(matrix, col)
+        results = []
+        for c, score in ranked:
+            if available is not None and matrix.ingredient_ids[c] not in available:
+                continue
+            results.append(Substitute(matrix.ingredient_ids[c], matrix.ingredient_names[c], round(score, 4)))
+            if len(results) == k:
+                break
+        return results
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# server.py builds its database URI at import; tests never connect, so point it nowhere
+os.environ.update(DATABASE_USER='test', DATABASE_PASS='test', DATABASE_HOST='127.0.0.1:1', DATABASE_NAME='test')
+os.environ.pop('REFCACHE_CHANNEL', None)
+os.environ.pop('DATABASE_REPLICA_HOSTS', None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,36 @@
+"""
+With the database unreachable (conftest points DATABASE_HOST nowhere), pages
+with conditional GET must still answer with their own error page or JSON
+error instead of an unhandled 500 from reading the resource versions.
+"""
+import pytest
+
+import server
+
+
+@pytest.fixture(scope='module')
+def client():
+    app = server.create_app()
+    return app.test_client()
+
+
+@pytest.mark.parametrize('path', ['/recipes', '/cookable', '/mealplans'])
+def test_page_shows_its_error_page(client, path):
+    response = client.get(path)
+    assert response.status_code == 200
+    assert response.get_data().startswith(b'<h3>Error')
+    assert 'ETag' not in response.headers
+
+
+@pytest.mark.parametrize('path', ['/api/recipes/search?q=soup', '/api/recipes/5/similar',
+                                  '/api/households/1/stats'])
+def test_api_returns_json_error(client, path):
+    response = client.get(path)
+    assert response.status_code == 500
+    assert 'error' in response.get_json()
+    assert 'ETag' not in response.headers
+
+
+def test_bad_metric_is_still_a_400(client):
+    response = client.get('/api/recipes/5/similar?metric=bogus')
+    assert response.status_code == 400
@@ -0,0 +1,80 @@
+"""
+/mealplans must render a household with 50 plans in the same number of
+statements as one with a single plan (no query per plan in the view, the
+loaders or the templates).
+
+The page is rendered through the Flask test client against a real database,
+and the statements are counted by metrics.py (the Server-Timing header). Set
+TEST_DATABASE_URL to a database with the app's schema and some recipes, e.g.
+the one bench/generate.py builds; the test adds two households and deletes
+them again.
+"""
+import os
+import re
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+
+import meal_plans
+import server
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="set TEST_DATABASE_URL to run against Postgres")
+
+
+@pytest.fixture(scope='module')
+def households():
+    """{number of plans: household_id}, for households with 1 and 50 plans of two recipes each."""
+    engine = create_engine(make_url(TEST_DATABASE_URL).set(drivername='postgresql+psycopg'))
+    created = {}
+    try:
+        with engine.begin() as conn:
+            recipe_ids = conn.execute(text("SELECT recipe_id FROM recipe ORDER BY recipe_id LIMIT 2")).scalars().all()
+            if len(recipe_ids) < 2:
+                pytest.skip("the test database has no recipes")
+            for n_plans in (1, 50):
+                hid = created[n_plans] = conn.execute(text(
+                    "INSERT INTO household (household_name) VALUES (:name) RETURNING household_id"
+                ), {'name': f"statement count test, {n_plans} plans"}).scalar_one()
+                for i in range(n_plans):
+                    plan_id = meal_plans.create_plan(conn, hid, f"plan {i}", recipe_ids[0])
+                    meal_plans.add_recipes(conn, plan_id, [(recipe_ids[1], None)])
+        yield created
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM household WHERE household_id = ANY(:hids)"),
+                         {'hids': list(created.values())})
+        engine.dispose()
+
+
+@pytest.fixture(scope='module')
+def client(households):
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(server, 'DATABASEURI', TEST_DATABASE_URL)
+        patch.setattr(server, 'REPLICA_URIS', [])
+        app = server.create_app()
+        yield app.test_client()
+        server.aio.dispose_all()
+        server.db.dispose_all()
+
+
+def statements(client, hid):
+    """(statements the render ran, plan cards on the page)."""
+    response = client.get(f"/mealplans?hid={hid}")
+    assert response.status_code == 200
+    page = response.get_data(as_text=True)
+    assert not page.startswith('<h3>Error'), page[:500]
+    timing = response.headers['Server-Timing']
+    return int(re.search(r'desc="(\d+) queries"', timing).group(1)), page.count('name="pid"')
+
+
+def test_plan_count_does_not_change_statement_count(client, households):
+    # Warm the process caches (household list, versions) so both renders start alike
+    statements(client, households[1])
+
+    one, one_cards = statements(client, households[1])
+    fifty, fifty_cards = statements(client, households[50])
+    assert (one_cards, fifty_cards) == (1, 50)
+    assert fifty == one
@@ -0,0 +1,166 @@
+"""
+Conditional GET for read-only pages.
+
+Every page declares the resources it is built from:
+
+    'recipes'          recipe, recipe_made_with_ingredient and ingredient
+    'households'       the household list
+    'household:<id>'   one household's inventory and meal plans
+    'plan:<id>'        one meal plan's recipes and grocery list
+
+resource_versions holds a counter and updated_at per resource
+(migrations/004_resource_versions.sql). Triggers bump 'recipes' and
+'households' and NOTIFY them on the reference cache channel (006); the write paths bump 'household:<id>' and 'plan:<id>' in their
+own transaction with bump(). A page's ETag is a hash of its URL and the versions of its
+resources, and its Last-Modified is the newest updated_at, so a repeat view
+with If-None-Match / If-Modified-Since gets a 304 without running the view.
+
+current() is read once per request, before the view runs. Data a view takes
+from a process cache (the household list, the cookable index, the recipe
+matrix) must be at least as new as these versions, or a stale page would be
+served and cached under the current ETag, so those caches remember the
+version they were loaded at and reload once it moves (see ReferenceCache.get).
+
+The version table is read through the reference cache under the key
+'versions', so a 304 does not touch the database either. Writers publish that
+key on commit; with REFCACHE_CHANNEL set every worker drops its copy at once
+and versions are cached for REFCACHE_TTL. Without a channel other workers
+would not hear about a write, so versions are re-read on every request
+(VERSIONS_TTL overrides either default). Requests served from a read replica
+always read the replica's versions, since its data may be behind the primary's.
+"""
+import functools
+import hashlib
+import logging
+import os
+from datetime import timezone
+
+from flask import g, has_app_context, make_response, request
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+log = logging.getLogger(__name__)
+
+
+def _build_token(root):
+    """Changes whenever the code or templates are deployed, so old ETags do not match new pages."""
+    latest = 0.0
+    for folder in (root, os.path.join(root, 'templates')):
+        for name in os.listdir(folder):
+            if name.endswith(('.py', '.html')):
+                latest = max(latest, os.path.getmtime(os.path.join(folder, name)))
+    return str(latest)
+
+
+class ResourceVersions:
+
+    def __init__(self, cache, load, ttl=None, shared=None):
+        """
+        cache is the ReferenceCache; load() returns the resource_versions rows.
+        shared() is false for requests that read from a read replica: they
+        load their own versions instead of using the cached copy (read on the
+        primary), so their ETags match the data they render.
+        """
+        self.cache = cache
+        self.load = load
+        self.shared = shared
+        if ttl is None:
+            value = os.getenv("VERSIONS_TTL")
+            ttl = float(value) if value else (cache.ttl if cache.channel else 0)
+        self.ttl = ttl
+        self.build = _build_token(os.path.dirname(os.path.abspath(__file__)))
+        cache.on_invalidate('households', self.invalidate)
+        cache.on_invalidate('recipes', self.invalidate)
+
+    def current(self):
+        """{resource: (version, updated_at)}, read once per request."""
+        current = g.get('_resource_versions') if has_app_context() else None
+        if current is None:
+            load = lambda: {row.resource: (row.version, row.updated_at) for row in self.load()}
+            if self.shared is None or self.shared():
+                current = self.cache.get('versions', load, ttl=self.ttl)
+            else:
+                current = load()
+            if has_app_context():
+                g._resource_versions = current
+        return current
+
+    def version(self, name, current=None):
+        """name's version number (0 if it was never bumped), from current() or a dict it returned."""
+        return (current if current is not None else self.current()).get(name, (0, None))[0]
+
+    def bump(self, conn, *resources, plan_ids=()):
+        """
+        Bumps resources, plus each plan in plan_ids and its household, on conn's
+        transaction. Call invalidate() once it commits. Plans must still exist,
+        so bump before deleting one.
+        """
+        conn.execute(text("""
+            INSERT INTO resource_versions (resource, version, updated_at)
+            SELECT resource, 1, now()
+            FROM (
+                SELECT unnest(CAST(:resources AS text[])) AS resource
+                UNION
+                SELECT unnest(ARRAY['household:' || household_id, 'plan:' || plan_id])
+                FROM meal_plans WHERE plan_id = ANY(CAST(:pids AS integer[]))
+            ) changed
+            ON CONFLICT (resource)
+            DO UPDATE SET version = resource_versions.version + 1, updated_at = now()
+        """), {'resources': list(resources), 'pids': [int(pid) for pid in plan_ids]})
+        self.cache.publish(conn, 'versions')
+
+    def invalidate(self):
+        self.cache.invalidate('versions')
+        if has_app_context():
+            g.pop('_resource_versions', None)
+
+    def conditional(self, resources, cache_control='private, no-cache'):
+        """
+        Decorator for GET views. resources() returns the resource names the
+        response is built from (or None to skip caching for this request).
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                try:
+                    names = resources() if request.method in ('GET', 'HEAD') else None
+                    # Versions are read before the view queries anything, so a
+                    # write in between can only make the ETag older, never newer
+                    versions = self.current() if names is not None else None
+                except SQLAlchemyError:
+                    # The database is down or resource_versions is missing (004 not
+                    # applied): the view reports the error its own way, uncached
+                    log.exception("resource versions unavailable for %s", request.path)
+                    names = None
+                if names is None:
+                    return view(*args, **kwargs)
+                stamps = [versions.get(name, (0, None)) for name in sorted(set(names))]
+                etag = hashlib.sha1(repr((self.build, request.full_path,
+                                          [stamp[0] for stamp in stamps])).encode()).hexdigest()
+                last_modified = max((stamp[1] for stamp in stamps if stamp[1] is not None), default=None)
+                if last_modified is not None:
+                    last_modified = last_modified.astimezone(timezone.utc)
+
+                if self._fresh(etag, last_modified):
+                    response = make_response('', 304)
+                else:
+                    response = make_response(view(*args, **kwargs))
+                    # Views report database errors as a 200 page starting with <h3>Error; never cache those
+                    if response.status_code != 200 or response.get_data().startswith(b'<h3>Error'):
+                        return response
+                response.set_etag(etag, weak=True)
+                if last_modified is not None:
+                    response.last_modified = last_modified
+                response.headers['Cache-Control'] = cache_control
+                return response
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def _fresh(etag, last_modified):
+        if request.if_none_match:
+            return request.if_none_match.contains_weak(etag)
+        if request.if_modified_since and last_modified is not None:
+            # HTTP dates have whole seconds
+            return last_modified.replace(microsecond=0) <= request.if_modified_since
+        return False